@@ -0,0 +1,111 @@
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Stop once the ability estimate is this precise (standard error on the theta scale) ...
+CAT_SE_TARGET = float(os.getenv("CAT_SE_TARGET", "0.35"))
+# ... but never before / after this many items
+CAT_MIN_ITEMS = int(os.getenv("CAT_MIN_ITEMS", "5"))
+CAT_MAX_ITEMS = int(os.getenv("CAT_MAX_ITEMS", "30"))
+# Pick at random among the N most informative items so the best items are not over-exposed
+CAT_RANDOMESQUE = int(os.getenv("CAT_RANDOMESQUE", "3"))
+# Uncalibrated items: a = 1.7 is the logistic equivalent of a = 1 on the normal-ogive scale
+CAT_DEFAULT_DISCRIMINATION = float(os.getenv("CAT_DEFAULT_DISCRIMINATION", "1.7"))
+# Online difficulty calibration (Elo-style step, shrinking with the item's response count)
+CAT_ITEM_LEARNING_RATE = float(os.getenv("CAT_ITEM_LEARNING_RATE", "0.4"))
+
+# Same bands as SCALES_TEXT in gemini_client, lowest first
+BANDS = {
+    "TOEIC": ["10-250", "255-400", "405-600", "605-780", "785-900", "905-990"],
+    "IELTS": ["0-3.5", "4.0-5.0", "5.5-6.0", "6.5-7.0", "7.5-8.0", "8.5-9.0"],
+}
+# theta -> score knots: band boundaries sit at theta = -2, -1, 0, 1, 2
+_SCORE_KNOTS = {
+    "TOEIC": [10, 255, 405, 605, 785, 905, 990],
+    "IELTS": [0.0, 4.0, 5.5, 6.5, 7.5, 8.5, 9.0],
+}
+_THETA_KNOTS = np.array([-3.0, -2.0, -1.0, 0.0, 1.0, 2.0, 3.0])
+_BAND_CENTERS = np.array([-2.5, -1.5, -0.5, 0.5, 1.5, 2.5])
+
+# EAP quadrature with a standard normal prior
+_GRID = np.linspace(-4.0, 4.0, 81)
+_PRIOR = np.exp(-0.5 * _GRID ** 2)
+
+
+def exam_bands(exam_type: str) -> list:
+    return BANDS.get((exam_type or "TOEIC").upper(), BANDS["TOEIC"])
+
+
+def level_to_theta(exam_type: str, level: Optional[str]) -> float:
+    """Starting ability / prior item difficulty for a band string ('605-780' or 'TOEIC 605-780')."""
+    text = (level or "").upper().replace((exam_type or "").upper(), "").strip()
+    bands = exam_bands(exam_type)
+    if text in bands:
+        return float(_BAND_CENTERS[bands.index(text)])
+    return 0.0
+
+
+def theta_to_level(exam_type: str, theta: float) -> Dict[str, Any]:
+    """Band (formatted like current_level/post_test_level) and interpolated score for theta."""
+    exam = (exam_type or "TOEIC").upper()
+    exam = exam if exam in BANDS else "TOEIC"
+    band = BANDS[exam][int(np.searchsorted(_THETA_KNOTS[1:-1], theta, side="right"))]
+    score = float(np.interp(theta, _THETA_KNOTS, _SCORE_KNOTS[exam]))
+    score = round(score) if exam == "TOEIC" else round(score * 2) / 2
+    return {"level": f"{exam} {band}", "band": band, "score_estimate": score}
+
+
+def probability(theta: Any, a: Any, b: Any) -> np.ndarray:
+    """2PL probability of a correct answer."""
+    return 1.0 / (1.0 + np.exp(-np.asarray(a) * (np.asarray(theta) - np.asarray(b))))
+
+
+def information(theta: float, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    p = probability(theta, a, b)
+    return np.asarray(a) ** 2 * p * (1.0 - p)
+
+
+def estimate_ability(a: np.ndarray, b: np.ndarray, correct: np.ndarray,
+                     prior_mean: float = 0.0) -> Tuple[float, float]:
+    """
+    EAP estimate and posterior SD of theta after the given responses (2PL, normal prior
+    centred on `prior_mean`); stays finite for all-correct / all-wrong patterns.
+    """
+    grid = _GRID + prior_mean
+    if len(a):
+        p = probability(grid[:, None], np.asarray(a)[None, :], np.asarray(b)[None, :])
+        x = np.asarray(correct, dtype=float)[None, :]
+        log_like = (x * np.log(p) + (1 - x) * np.log1p(-p)).sum(axis=1)
+    else:
+        log_like = np.zeros_like(grid)
+    posterior = _PRIOR * np.exp(log_like - log_like.max())
+    posterior /= posterior.sum()
+    theta = float((grid * posterior).sum())
+    se = float(np.sqrt(((grid - theta) ** 2 * posterior).sum()))
+    return theta, se
+
+
+def select_item(theta: float, a: np.ndarray, b: np.ndarray, rng: Optional[np.random.Generator] = None) -> int:
+    """Index of the next item: maximum Fisher information at theta (randomesque top-N)."""
+    info = information(theta, a, b)
+    top = min(CAT_RANDOMESQUE, len(info))
+    if top <= 1:
+        return int(np.argmax(info))
+    candidates = np.argpartition(-info, top - 1)[:top]
+    return int((rng or np.random.default_rng()).choice(candidates))
+
+
+def should_stop(se: float, administered: int, remaining: int) -> bool:
+    if remaining <= 0 or administered >= CAT_MAX_ITEMS:
+        return True
+    return administered >= CAT_MIN_ITEMS and se <= CAT_SE_TARGET
+
+
+def calibrate_difficulty(b: float, a: float, theta: float, correct: bool, responses: int) -> float:
+    """Move an item's difficulty toward what this response suggests (Elo-style update)."""
+    step = CAT_ITEM_LEARNING_RATE / np.sqrt(1.0 + responses)
+    return float(np.clip(b - step * (float(correct) - probability(theta, a, b)), -4.0, 4.0))
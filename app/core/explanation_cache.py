@@ -0,0 +1,145 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from dotenv import load_dotenv
+
+from app.core.storage import SQLiteStore
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EXPLANATION_CACHE_PATH = os.getenv("EXPLANATION_CACHE_PATH", "data/explanation_cache.db")
+EXPLANATION_CACHE_MAX_ENTRIES = int(os.getenv("EXPLANATION_CACHE_MAX_ENTRIES", "50000"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS explanations (
+    key TEXT PRIMARY KEY,
+    explain TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_explanations_last_used ON explanations (last_used);
+"""
+
+
+def explanation_key(question: Optional[str], expected: Optional[str], given: Optional[str]) -> Optional[str]:
+    """
+    Hash of (question text, expected answer, wrong answer); whitespace and answer case are
+    folded so the same mistake on the same question maps to one entry across students.
+    None when the question text is unknown, since the answers alone are ambiguous.
+    """
+    text = " ".join((question or "").split())
+    if not text:
+        return None
+    raw = "\x1f".join((text, (expected or "").strip().upper(), (given or "").strip().upper()))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ExplanationCache(SQLiteStore):
+    """
+    LRU of Gemini explanations for wrong answers, shared by every student taking the
+    same test. Lookups are served from memory; the SQLite file persists entries (and
+    their recency) across restarts and is trimmed to the same size.
+    `_lock` guards only the in-memory LRU, so lookups made on the event loop never wait
+    for disk I/O; `_db_lock` serializes the SQLite reads and writes.
+    """
+
+    schema = _SCHEMA
+
+    def __init__(self, path: str = EXPLANATION_CACHE_PATH, max_entries: int = EXPLANATION_CACHE_MAX_ENTRIES):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._touched: Dict[str, float] = {}
+        self._loaded = False
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self):
+        """Warm the LRU with the most recently used entries of the backing file."""
+        with self._db_lock:
+            if self._loaded:
+                return
+            rows = self._connect().execute(
+                "SELECT key, explain FROM explanations ORDER BY last_used DESC LIMIT ?", (self.max_entries,)
+            ).fetchall()
+            with self._lock:
+                for key, explain in reversed(rows):
+                    self._entries.setdefault(key, explain)
+                self._loaded = True
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        found = {}
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                explain = self._entries.get(key)
+                if explain is None:
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(key)
+                self._touched[key] = now
+                found[key] = explain
+                self.hits += 1
+        return found
+
+    def put_many(self, items: Dict[str, str]):
+        """Insert/refresh entries, persist them with pending recency updates, then trim."""
+        now = time.time()
+        with self._lock:
+            for key, explain in items.items():
+                self._entries[key] = explain
+                self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+            self.evictions += len(evicted)
+            touched, self._touched = self._touched, {}
+
+        with self._db_lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO explanations (key, explain, last_used) VALUES (?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET explain = excluded.explain, last_used = excluded.last_used",
+                    [(key, explain, now) for key, explain in items.items()],
+                )
+                conn.executemany(
+                    "UPDATE explanations SET last_used = ? WHERE key = ?",
+                    [(used, key) for key, used in touched.items() if key not in items],
+                )
+                conn.executemany("DELETE FROM explanations WHERE key = ?", [(key,) for key in evicted])
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "path": self.path,
+        }
+
+    async def aget_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        if not self._loaded:
+            await asyncio.to_thread(self.load)
+        return self.get_many(keys)
+
+    async def aput_many(self, items: Dict[str, str]):
+        if items:
+            if not self._loaded:
+                await asyncio.to_thread(self.load)
+            await asyncio.to_thread(self.put_many, items)
+
+
+explanation_cache = ExplanationCache()
@@ -0,0 +1,450 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, Any, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from app.core.gemini_router import ModelTier, Route, router
+from app.core.gemini_scheduler import Priority, scheduler
+from app.core.metrics import observe_stage, record_gemini_call, timed_stage
+from app.core.retry_policy import GEMINI_MAX_RETRIES, LatencyTracker, RetryBudget, backoff_delay
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+
+# Connection pool limits shared by every Gemini call in this worker
+GEMINI_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", "50"))
+GEMINI_MAX_KEEPALIVE = int(os.getenv("GEMINI_MAX_KEEPALIVE", "20"))
+GEMINI_KEEPALIVE_EXPIRY = float(os.getenv("GEMINI_KEEPALIVE_EXPIRY", "60"))
+# Keep-alive connections (TCP + TLS handshake) opened at startup, before the first real call
+GEMINI_WARMUP_CONNECTIONS = int(os.getenv("GEMINI_WARMUP_CONNECTIONS", "4"))
+GEMINI_WARMUP_TIMEOUT = float(os.getenv("GEMINI_WARMUP_TIMEOUT", "5"))
+
+# Event-loop lag monitor: how often we probe and when we start warning
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+LOOP_LAG_WARN_SECONDS = float(os.getenv("LOOP_LAG_WARN_SECONDS", "0.2"))
+
+DEFAULT_TIMEOUT = httpx.Timeout(
+    connect=10.0,   # thời gian chờ kết nối
+    read=120.0,     # chờ dữ liệu phản hồi
+    write=30.0,     # ghi dữ liệu request
+    pool=10.0       # lấy connection từ pool
+)
+
+
+def extract_text(data: Dict[str, Any]) -> Optional[str]:
+    """
+    Given the raw HTTP response JSON from Gemini, attempt to extract the assistant text.
+    Handles a few possible response shapes.
+    """
+    # Expected shape: data["candidates"][0]["content"]["parts"][0]["text"]
+    try:
+        # common current shape
+        return data["candidates"][0]["content"]["parts"][0]["text"]
+    except Exception:
+        # try other shapes: some models return "output" or "result"
+        # best-effort search for any string in nested dict
+        def find_str(obj):
+            if isinstance(obj, str):
+                return obj
+            if isinstance(obj, dict):
+                for v in obj.values():
+                    res = find_str(v)
+                    if res:
+                        return res
+            if isinstance(obj, list):
+                for item in obj:
+                    res = find_str(item)
+                    if res:
+                        return res
+            return None
+        return find_str(data)
+
+
+def _request_timeout(timeout: Optional[float]) -> httpx.Timeout:
+    if timeout is None:
+        return DEFAULT_TIMEOUT
+    timeout = max(0.1, timeout)
+    return httpx.Timeout(timeout, connect=min(DEFAULT_TIMEOUT.connect, timeout))
+
+
+def _is_overload_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    try:
+        return float(resp.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _chunk_text(data: Dict[str, Any]) -> str:
+    """Text of one streamed chunk; unlike extract_text, no best-effort fallback
+    (the final chunk often carries only finishReason/usageMetadata)."""
+    parts = []
+    for candidate in data.get("candidates") or []:
+        for part in (candidate.get("content") or {}).get("parts") or []:
+            if isinstance(part.get("text"), str):
+                parts.append(part["text"])
+    return "".join(parts)
+
+
+class GeminiError(RuntimeError):
+    """A failed Gemini call; `retryable` is True for timeouts, network errors, 429 and 5xx."""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class LoopLagMonitor:
+    """
+    Periodically measures how late the event loop wakes a sleeping task.
+    A large lag means something is blocking the loop (sync I/O, heavy CPU).
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, warn_seconds: float = LOOP_LAG_WARN_SECONDS):
+        self.interval = interval
+        self.warn_seconds = warn_seconds
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.samples = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.samples += 1
+            if lag > self.warn_seconds:
+                logger.warning("Event loop lag %.3fs exceeds %.3fs", lag, self.warn_seconds)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "last_lag_seconds": round(self.last_lag, 4),
+            "max_lag_seconds": round(self.max_lag, 4),
+            "samples": self.samples,
+        }
+
+
+class GeminiGateway:
+    """
+    Single entry point for every Gemini call in the process.
+    Owns one pooled keep-alive httpx.AsyncClient, opened in the app lifespan
+    (or lazily on first use outside of it) and closed on shutdown.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self.loop_monitor = LoopLagMonitor()
+        self.retry_budget = RetryBudget()
+        self.latency = LatencyTracker()
+        self.requests = 0
+        self.retries = 0
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            limits = httpx.Limits(
+                max_connections=GEMINI_MAX_CONNECTIONS,
+                max_keepalive_connections=GEMINI_MAX_KEEPALIVE,
+                keepalive_expiry=GEMINI_KEEPALIVE_EXPIRY,
+            )
+            self._client = httpx.AsyncClient(
+                base_url=GEMINI_BASE_URL,
+                timeout=DEFAULT_TIMEOUT,
+                limits=limits,
+                headers={"Content-Type": "application/json"},
+            )
+        return self._client
+
+    async def start(self):
+        self._get_client()
+        self.loop_monitor.start()
+
+    async def warmup(self, connections: int = GEMINI_WARMUP_CONNECTIONS) -> int:
+        """
+        Open up to `connections` pooled connections to GEMINI_BASE_URL with concurrent HEAD
+        requests (no API key, no quota), so the first Gemini calls skip the TCP + TLS setup.
+        Any HTTP status counts as a warm connection; failures are logged, never raised.
+        Returns the number of connections opened.
+        """
+        connections = min(connections, GEMINI_MAX_KEEPALIVE)
+        if connections <= 0 or not router.has_keys:
+            return 0
+        client = self._get_client()
+
+        async def _open() -> bool:
+            try:
+                await client.head("", timeout=GEMINI_WARMUP_TIMEOUT)
+                return True
+            except httpx.HTTPError as e:
+                logger.warning("Gemini connection warm-up failed: %s", e)
+                return False
+
+        with timed_stage("warmup_connect"):
+            opened = await asyncio.gather(*(_open() for _ in range(connections)))
+        return sum(opened)
+
+    async def aclose(self):
+        await self.loop_monitor.stop()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def generate_content(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+        priority: Priority = Priority.BULK,
+        tier: ModelTier = ModelTier.STRONG,
+    ) -> Dict[str, Any]:
+        """
+        POST a single-turn prompt to `models/{model}:generateContent` and return the raw JSON.
+        Without an explicit `model`, every attempt is routed to a (key, model) pair of `tier`.
+        `timeout` (seconds) caps the whole call, e.g. to fit a caller's latency budget.
+        The call is admitted by the process-wide scheduler under `priority`, hedged after
+        the model's p95 latency and retried with jittered backoff while the retry budget allows.
+        Raises RuntimeError (GeminiError) if no API key is configured or the call fails,
+        SchedulerOverloaded if the priority's queue is full.
+        """
+        if not router.has_keys:
+            raise RuntimeError("GEMINI_API_KEY not set in environment; cannot call Gemini")
+
+        body: Dict[str, Any] = {"contents": [{"parts": [{"text": prompt}]}]}
+        if generation_config:
+            body["generationConfig"] = generation_config
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        self.requests += 1
+        self.retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged(tier, model, body, priority, deadline)
+            except GeminiError as e:
+                if not e.retryable or attempt >= GEMINI_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                if deadline is not None and loop.time() + delay >= deadline:
+                    raise
+                if not self.retry_budget.try_withdraw():
+                    raise
+                attempt += 1
+                self.retries += 1
+                logger.info("Retrying Gemini call in %.2fs (attempt %d): %s", delay, attempt, e)
+                await asyncio.sleep(delay)
+
+    async def _hedged(self, tier: ModelTier, model: Optional[str], body: Dict[str, Any],
+                      priority: Priority, deadline: Optional[float]) -> Dict[str, Any]:
+        """
+        Start one attempt; if it is still running after the model's (or tier's) p95 latency,
+        start a second one (budget permitting) and return whichever succeeds first.
+        The hedge is routed independently, so it usually lands on another key.
+        """
+        primary = asyncio.ensure_future(self._attempt(tier, model, body, priority, deadline))
+        delay = self.latency.hedge_delay(model or tier.value)
+        if delay is None:
+            return await primary
+
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+            if deadline is not None and asyncio.get_running_loop().time() >= deadline:
+                return await primary
+            if not self.retry_budget.try_withdraw():
+                return await primary
+
+            hedge = asyncio.ensure_future(self._attempt(tier, model, body, priority, deadline))
+            self.hedges_sent += 1
+            pending.add(hedge)
+            errors: Dict[asyncio.Future, BaseException] = {}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedges_won += 1
+                        return task.result()
+                    errors[task] = task.exception()
+            raise errors.get(primary) or errors[hedge]
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _attempt(self, tier: ModelTier, model: Optional[str], body: Dict[str, Any],
+                       priority: Priority, deadline: Optional[float]) -> Dict[str, Any]:
+        """One HTTP call under a scheduler slot. Raises GeminiError (retryable or not)."""
+        async with scheduler.slot(priority) as slot:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    raise GeminiError("Latency budget exhausted before calling Gemini", retryable=False)
+            route: Route = router.pick(tier, model)
+            status_code, retry_after, data = None, None, None
+            started = time.perf_counter()
+            try:
+                resp = await self._get_client().post(
+                    f"/models/{route.model}:generateContent",
+                    params={"key": route.key},
+                    json=body,
+                    timeout=_request_timeout(timeout),
+                )
+                status_code, retry_after = resp.status_code, _retry_after(resp)
+                logger.debug("Gemini response status code: %s (%.2fs, %s)",
+                             resp.status_code, time.perf_counter() - started, route.label)
+                slot.overloaded = _is_overload_status(resp.status_code)
+                resp.raise_for_status()
+                data = resp.json()
+            except httpx.TimeoutException as te:
+                slot.overloaded = True
+                raise GeminiError(f"Timed out calling Gemini: {te!r}", retryable=True)
+            except httpx.RequestError as re:
+                raise GeminiError(f"Network error when calling Gemini: {re}", retryable=True)
+            except httpx.HTTPStatusError as he:
+                status = he.response.status_code
+                raise GeminiError(f"Bad response from Gemini: {status} - {he}", retryable=_is_overload_status(status))
+            except ValueError as ve:
+                raise GeminiError(f"Gemini returned invalid JSON: {ve}", retryable=True)
+            finally:
+                elapsed = time.perf_counter() - started
+                router.report(route, elapsed, status_code, retry_after)
+                observe_stage("network", elapsed)
+                record_gemini_call(route.model, status_code, data)
+
+            self.latency.record(model or tier.value, elapsed)
+            return data
+
+    async def generate_text(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+        priority: Priority = Priority.BULK,
+        tier: ModelTier = ModelTier.STRONG,
+    ) -> str:
+        """Same as generate_content but returns only the assistant text."""
+        data = await self.generate_content(
+            prompt, model=model, generation_config=generation_config, timeout=timeout, priority=priority, tier=tier
+        )
+        with timed_stage("extract"):
+            text = extract_text(data)
+        if not text:
+            raise RuntimeError(f"Could not extract text from Gemini response. Full response: {str(data)[:2000]}")
+        return text
+
+    async def stream_text(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        priority: Priority = Priority.BULK,
+        tier: ModelTier = ModelTier.STRONG,
+    ) -> AsyncIterator[str]:
+        """
+        Call `models/{model}:streamGenerateContent` (SSE) and yield text chunks as they arrive.
+        The scheduler slot and the routed (key, model) pair are held for the whole stream.
+        Raises RuntimeError if no API key is configured or the call fails.
+        """
+        if not router.has_keys:
+            raise RuntimeError("GEMINI_API_KEY not set in environment; cannot call Gemini")
+
+        body: Dict[str, Any] = {"contents": [{"parts": [{"text": prompt}]}]}
+        if generation_config:
+            body["generationConfig"] = generation_config
+
+        async with scheduler.slot(priority) as slot:
+            route: Route = router.pick(tier, model)
+            status_code, retry_after, first_byte, usage = None, None, None, None
+            started = time.perf_counter()
+            try:
+                async with self._get_client().stream(
+                    "POST",
+                    f"/models/{route.model}:streamGenerateContent",
+                    params={"key": route.key, "alt": "sse"},
+                    json=body,
+                ) as resp:
+                    status_code, retry_after = resp.status_code, _retry_after(resp)
+                    # Route latency is time to headers; the stream length depends on the prompt
+                    first_byte = time.perf_counter() - started
+                    if resp.status_code >= 400:
+                        slot.overloaded = _is_overload_status(resp.status_code)
+                        await resp.aread()
+                        resp.raise_for_status()
+                    async for line in resp.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        payload = line[len("data:"):].strip()
+                        if not payload:
+                            continue
+                        chunk = json.loads(payload)
+                        if chunk.get("usageMetadata"):
+                            usage = chunk
+                        text = _chunk_text(chunk)
+                        if text:
+                            yield text
+            except httpx.TimeoutException as te:
+                slot.overloaded = True
+                raise RuntimeError(f"Timed out calling Gemini: {te!r}")
+            except httpx.RequestError as re:
+                raise RuntimeError(f"Network error when calling Gemini: {re}")
+            except httpx.HTTPStatusError as he:
+                raise RuntimeError(f"Bad response from Gemini: {he.response.status_code} - {he}")
+            finally:
+                router.report(route, first_byte or time.perf_counter() - started, status_code, retry_after)
+                observe_stage("stream", time.perf_counter() - started)
+                record_gemini_call(route.model, status_code, usage)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "event_loop": self.loop_monitor.stats(),
+            "scheduler": scheduler.stats(),
+            "routes": router.stats(),
+            "resilience": {
+                "requests": self.requests,
+                "retries": self.retries,
+                "hedges_sent": self.hedges_sent,
+                "hedges_won": self.hedges_won,
+                "hedge_win_rate": round(self.hedges_won / self.hedges_sent, 4) if self.hedges_sent else 0.0,
+                "retry_budget_tokens": round(self.retry_budget.tokens, 2),
+                "retry_budget_exhausted": self.retry_budget.exhausted,
+                "latency": self.latency.stats(),
+            },
+        }
+
+
+gateway = GeminiGateway()
@@ -0,0 +1,148 @@
+import os
+import time
+import random
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Deque, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+
+# Comma-separated pool of keys; GEMINI_API_KEY alone still works
+GEMINI_API_KEYS = _split(os.getenv("GEMINI_API_KEYS")) or _split(os.getenv("GEMINI_API_KEY"))
+# MODEL_NAME (legacy, single model) is the default for both tiers when set
+GEMINI_MODELS_FAST = _split(os.getenv("GEMINI_MODELS_FAST")) or [os.getenv("MODEL_NAME", "gemini-2.0-flash")]
+GEMINI_MODELS_STRONG = _split(os.getenv("GEMINI_MODELS_STRONG")) or [os.getenv("MODEL_NAME", "gemini-2.5-flash")]
+# Requests per minute allowed per (key, model); 0 = not enforced locally
+GEMINI_KEY_RPM = int(os.getenv("GEMINI_KEY_RPM", "0"))
+# How long a (key, model) pair is avoided after a 429
+GEMINI_KEY_COOLDOWN = float(os.getenv("GEMINI_KEY_COOLDOWN", "30"))
+# Tests up to this many questions are generated with the fast tier
+SMALL_JOB_QUESTIONS = int(os.getenv("SMALL_JOB_QUESTIONS", "10"))
+
+
+class ModelTier(str, Enum):
+    FAST = "fast"       # small generation jobs, repairs
+    STRONG = "strong"   # full grading analysis, large tests
+
+
+def tier_for_questions(num_questions: int) -> ModelTier:
+    return ModelTier.FAST if num_questions <= SMALL_JOB_QUESTIONS else ModelTier.STRONG
+
+
+@dataclass
+class Route:
+    key: str
+    model: str
+    in_flight: int = 0
+    ewma_latency: float = 5.0
+    cooldown_until: float = 0.0
+    calls: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    recent: Deque[float] = field(default_factory=deque)
+
+    def _trim(self, now: float):
+        while self.recent and now - self.recent[0] > 60:
+            self.recent.popleft()
+
+    def available(self, now: float) -> bool:
+        self._trim(now)
+        if now < self.cooldown_until:
+            return False
+        return not GEMINI_KEY_RPM or len(self.recent) < GEMINI_KEY_RPM
+
+    def score(self) -> float:
+        return self.ewma_latency * (1 + self.in_flight)
+
+    @property
+    def label(self) -> str:
+        # Never expose the key itself
+        return f"...{self.key[-4:]}/{self.model}"
+
+
+class GeminiRouter:
+    """
+    Spreads calls over every (API key, model) pair of the requested tier.
+    Pairs that were rate limited are cooled down, pairs at their local RPM quota are
+    skipped, and among the rest the one with the lowest latency x load score wins
+    (power of two random choices, so load still spreads when scores are close).
+    """
+
+    def __init__(self, keys: List[str] = None, tiers: Dict[ModelTier, List[str]] = None):
+        keys = GEMINI_API_KEYS if keys is None else keys
+        tiers = tiers or {ModelTier.FAST: GEMINI_MODELS_FAST, ModelTier.STRONG: GEMINI_MODELS_STRONG}
+        self._routes: Dict[tuple, Route] = {}
+        self._tiers: Dict[ModelTier, List[Route]] = {}
+        for tier, models in tiers.items():
+            self._tiers[tier] = [self._route(key, model) for model in models for key in keys]
+        self._keys = keys
+
+    def _route(self, key: str, model: str) -> Route:
+        if (key, model) not in self._routes:
+            self._routes[(key, model)] = Route(key=key, model=model)
+        return self._routes[(key, model)]
+
+    @property
+    def has_keys(self) -> bool:
+        return bool(self._keys)
+
+    def pick(self, tier: ModelTier = ModelTier.STRONG, model: Optional[str] = None) -> Route:
+        """Choose a route for one attempt. An explicit `model` only balances over keys."""
+        candidates = [self._route(key, model) for key in self._keys] if model else self._tiers[tier]
+        now = time.monotonic()
+        usable = [r for r in candidates if r.available(now)]
+        if not usable:
+            # Everything is cooling down or at quota: use whatever frees up first
+            usable = [min(candidates, key=lambda r: r.cooldown_until)]
+        sample = random.sample(usable, min(2, len(usable)))
+        route = min(sample, key=Route.score)
+        route.in_flight += 1
+        route.calls += 1
+        route.recent.append(now)
+        return route
+
+    def report(self, route: Route, latency: float, status_code: Optional[int] = None,
+               retry_after: Optional[float] = None):
+        """Record the outcome of a call made on `route` (status_code None = network error)."""
+        route.in_flight = max(0, route.in_flight - 1)
+        if status_code is not None and status_code < 400:
+            route.ewma_latency = 0.8 * route.ewma_latency + 0.2 * latency
+            return
+        route.errors += 1
+        if status_code == 429:
+            route.rate_limited += 1
+            route.cooldown_until = time.monotonic() + (retry_after or GEMINI_KEY_COOLDOWN)
+            logger.warning("Gemini route %s rate limited; cooling down", route.label)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            tier.value: [
+                {
+                    "route": r.label,
+                    "in_flight": r.in_flight,
+                    "ewma_latency_seconds": round(r.ewma_latency, 3),
+                    "calls": r.calls,
+                    "errors": r.errors,
+                    "rate_limited": r.rate_limited,
+                    "requests_last_minute": len(r.recent),
+                    "cooling_down": now < r.cooldown_until,
+                }
+                for r in routes
+            ]
+            for tier, routes in self._tiers.items()
+        }
+
+
+router = GeminiRouter()
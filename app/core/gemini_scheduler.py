@@ -0,0 +1,165 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Any, Deque, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GEMINI_CONCURRENCY_INITIAL = float(os.getenv("GEMINI_CONCURRENCY_INITIAL", "8"))
+GEMINI_CONCURRENCY_MIN = float(os.getenv("GEMINI_CONCURRENCY_MIN", "1"))
+GEMINI_CONCURRENCY_MAX = float(os.getenv("GEMINI_CONCURRENCY_MAX", "64"))
+# Multiplicative decrease factor applied on 429/5xx/timeouts or very slow calls
+GEMINI_CONCURRENCY_BACKOFF = float(os.getenv("GEMINI_CONCURRENCY_BACKOFF", "0.7"))
+# A successful call slower than this is treated as a sign of provider saturation
+GEMINI_LATENCY_THRESHOLD = float(os.getenv("GEMINI_LATENCY_THRESHOLD", "60"))
+GEMINI_QUEUE_LIMIT_INTERACTIVE = int(os.getenv("GEMINI_QUEUE_LIMIT_INTERACTIVE", "100"))
+GEMINI_QUEUE_LIMIT_BULK = int(os.getenv("GEMINI_QUEUE_LIMIT_BULK", "200"))
+GEMINI_QUEUE_LIMIT_BACKGROUND = int(os.getenv("GEMINI_QUEUE_LIMIT_BACKGROUND", "20"))
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0   # a student is waiting on the answer (/grade)
+    BULK = 1          # test generation, background grading jobs
+    BACKGROUND = 2    # speculative / best-effort work
+
+
+class SchedulerOverloaded(Exception):
+    """Raised when the queue for a priority class is full; maps to 503 + Retry-After."""
+
+    def __init__(self, priority: Priority, retry_after: int):
+        super().__init__(f"Gemini scheduler overloaded for {priority.name.lower()} requests; retry in {retry_after}s")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class Slot:
+    """Handle for one admitted call; the caller flags provider overload before releasing."""
+
+    def __init__(self, priority: Priority):
+        self.priority = priority
+        self.started = time.monotonic()
+        self.overloaded = False
+
+
+class AdaptiveScheduler:
+    """
+    Process-wide admission control for Gemini calls.
+    - AIMD concurrency limit: +1/limit per successful call, x BACKOFF on 429/5xx/timeouts
+      or calls slower than GEMINI_LATENCY_THRESHOLD (at most once per average call duration).
+    - Waiters are admitted strictly by priority class, FIFO within a class.
+    - Each class has a bounded queue; when full, SchedulerOverloaded is raised immediately.
+    """
+
+    def __init__(self,
+                 initial_limit: float = GEMINI_CONCURRENCY_INITIAL,
+                 min_limit: float = GEMINI_CONCURRENCY_MIN,
+                 max_limit: float = GEMINI_CONCURRENCY_MAX,
+                 queue_limits: Optional[Dict[Priority, int]] = None):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_limits = queue_limits or {
+            Priority.INTERACTIVE: GEMINI_QUEUE_LIMIT_INTERACTIVE,
+            Priority.BULK: GEMINI_QUEUE_LIMIT_BULK,
+            Priority.BACKGROUND: GEMINI_QUEUE_LIMIT_BACKGROUND,
+        }
+        self.in_flight = 0
+        self._queues: Dict[Priority, Deque[asyncio.Future]] = {p: deque() for p in Priority}
+        self._avg_latency = 5.0
+        self._last_decrease = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self.overload_signals = 0
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < max(1, math.floor(self.limit))
+
+    def _retry_after(self, priority: Priority) -> int:
+        waiting = sum(len(self._queues[p]) for p in Priority if p <= priority)
+        return max(1, math.ceil(self._avg_latency * (waiting + 1) / max(1.0, self.limit)))
+
+    async def acquire(self, priority: Priority = Priority.BULK) -> Slot:
+        higher_waiting = any(self._queues[p] for p in Priority if p <= priority)
+        if self._has_capacity() and not higher_waiting:
+            self.in_flight += 1
+            self.admitted += 1
+            return Slot(priority)
+
+        queue = self._queues[priority]
+        if len(queue) >= self.queue_limits[priority]:
+            self.rejected += 1
+            raise SchedulerOverloaded(priority, self._retry_after(priority))
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in queue:
+                queue.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # Slot was granted right as we were cancelled: hand it on
+                self.in_flight -= 1
+                self._dispatch()
+            raise
+        self.admitted += 1
+        return Slot(priority)
+
+    def release(self, slot: Slot):
+        latency = time.monotonic() - slot.started
+        self.in_flight -= 1
+        now = time.monotonic()
+        if slot.overloaded or latency > GEMINI_LATENCY_THRESHOLD:
+            self.overload_signals += 1
+            # One decrease per "round trip" so a burst of failures doesn't collapse the limit
+            if now - self._last_decrease > self._avg_latency:
+                self.limit = max(self.min_limit, self.limit * GEMINI_CONCURRENCY_BACKOFF)
+                self._last_decrease = now
+                logger.warning("Gemini concurrency limit decreased to %.1f", self.limit)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / max(1.0, self.limit))
+            self._avg_latency = 0.9 * self._avg_latency + 0.1 * latency
+        self._dispatch()
+
+    def _dispatch(self):
+        for priority in Priority:
+            queue = self._queues[priority]
+            while queue and self._has_capacity():
+                waiter = queue.popleft()
+                if waiter.done():
+                    continue
+                self.in_flight += 1
+                waiter.set_result(None)
+            if queue:
+                return
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority = Priority.BULK):
+        slot = await self.acquire(priority)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": {p.name.lower(): len(q) for p, q in self._queues.items()},
+            "avg_latency_seconds": round(self._avg_latency, 3),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "overload_signals": self.overload_signals,
+        }
+
+
+scheduler = AdaptiveScheduler()
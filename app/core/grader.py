@@ -1,41 +1,64 @@
 from collections import defaultdict
-from typing import List, Dict
+from typing import Dict, List, Tuple
 from app.core.schemas import QuestionKey, PerQuestionResult, SkillSummary
 
-def grade_locally(answer_key: List[QuestionKey], student_answers: Dict[int, str]):
-    total_correct = 0
-    per_q: List[PerQuestionResult] = []
-    skill_stats = defaultdict(lambda: {"correct": 0, "total": 0, "topics": defaultdict(int)})
-
-    for q in answer_key:
-        qid = q.id
-        expected = q.answer.strip().upper() if q.answer else ""
-        user_ans = student_answers.get(qid) or student_answers.get(str(qid))
-        correct = (user_ans.strip().upper() == expected) if user_ans else False
-        if correct:
-            total_correct += 1
-
-        explain_text = "Correct." if correct else f"Expected \"{expected}\" but got \"{(user_ans or 'no answer')}\"."
-
-        per_q.append(PerQuestionResult(
-            id=qid,
-            question=getattr(q, "question", None),
-            correct=correct,
-            expected_answer=expected,
-            user_answer=(user_ans.strip().upper() if user_ans else None),
-            skill=q.skill,
-            topic=q.topic,
-            explain=explain_text
-        ))
-
-        # skill stats
-        skill_key = q.skill or "Unknown"
-        skill_stats[skill_key]["total"] += 1
-        if correct:
-            skill_stats[skill_key]["correct"] += 1
-        if q.topic and not correct:
-            skill_stats[skill_key]["topics"][q.topic] += 1
+class CompiledAnswerKey:
+    """
+    Answer key prepared once for grading many submissions: expected answers are
+    normalized and ids stringified up front, so grading one student is a single
+    dict lookup per question (student_answers keys are strings, as in GradeRequest).
+    """
 
+    __slots__ = ("questions", "total")
+
+    def __init__(self, answer_key: List[QuestionKey]):
+        self.questions: List[Tuple[str, QuestionKey, str]] = [
+            (str(q.id), q, q.answer.strip().upper() if q.answer else "") for q in answer_key
+        ]
+        self.total = len(self.questions)
+
+    def grade(self, student_answers: Dict[str, str]):
+        total_correct = 0
+        per_q: List[PerQuestionResult] = []
+        skill_stats = defaultdict(lambda: {"correct": 0, "total": 0, "topics": defaultdict(int)})
+
+        for sid, q, expected in self.questions:
+            given = student_answers.get(sid)
+            user_ans = given.strip().upper() if given else None
+            correct = user_ans == expected if given else False
+            if correct:
+                total_correct += 1
+
+            explain_text = "Correct." if correct else f"Expected \"{expected}\" but got \"{(user_ans or 'no answer')}\"."
+
+            per_q.append(PerQuestionResult(
+                id=q.id,
+                question=q.question,
+                correct=correct,
+                expected_answer=expected,
+                user_answer=user_ans,
+                skill=q.skill,
+                topic=q.topic,
+                explain=explain_text
+            ))
+
+            # skill stats
+            skill_key = q.skill or "Unknown"
+            skill_stats[skill_key]["total"] += 1
+            if correct:
+                skill_stats[skill_key]["correct"] += 1
+            if q.topic and not correct:
+                skill_stats[skill_key]["topics"][q.topic] += 1
+
+        skill_summary, weak_topics = _summarize(skill_stats)
+        return total_correct, self.total, per_q, skill_summary, weak_topics
+
+
+def grade_locally(answer_key: List[QuestionKey], student_answers: Dict[str, str]):
+    return CompiledAnswerKey(answer_key).grade(student_answers)
+
+
+def _summarize(skill_stats):
     # skill summary
     skill_summary = []
     weak_topics_grab = []
@@ -57,4 +80,4 @@ def grade_locally(answer_key: List[QuestionKey], student_answers: Dict[int, str]
         if len(weak_topics) >= 3:
             break
 
-    return total_correct, len(answer_key), per_q, skill_summary, weak_topics
+    return skill_summary, weak_topics
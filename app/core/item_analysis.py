@@ -0,0 +1,145 @@
+import os
+import itertools
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.core.schemas import QuestionKey
+
+load_dotenv()
+
+# Items outside this difficulty range (share of correct answers) are flagged
+ITEM_P_VALUE_MIN = float(os.getenv("ITEM_P_VALUE_MIN", "0.2"))
+ITEM_P_VALUE_MAX = float(os.getenv("ITEM_P_VALUE_MAX", "0.95"))
+# Item-rest point-biserial below this separates strong and weak students too little
+ITEM_DISCRIMINATION_MIN = float(os.getenv("ITEM_DISCRIMINATION_MIN", "0.2"))
+
+_PERCENTILES = (10, 25, 50, 75, 90)
+BLANK = "(blank)"
+_BLANK_CODE = 0
+
+
+class _ChoiceCodes(dict):
+    """Raw answer -> small int code; each distinct raw string is normalized only once."""
+
+    def __init__(self):
+        super().__init__()
+        self.labels: Dict[str, int] = {"": _BLANK_CODE}
+
+    def __missing__(self, raw: Optional[str]) -> int:
+        code = self.labels.setdefault((raw or "").strip().upper(), len(self.labels))
+        self[raw] = code
+        return code
+
+
+def _round(value: Optional[float], digits: int = 4) -> Optional[float]:
+    if value is None or not np.isfinite(value):
+        return None
+    return round(float(value), digits)
+
+
+def _distribution(values: np.ndarray) -> Dict[str, Any]:
+    """Mean/std/percentiles of a per-student vector (accuracy in %, or raw score)."""
+    if not values.size:
+        return {}
+    pct = np.percentile(values, _PERCENTILES)
+    return {
+        "mean": _round(values.mean(), 2),
+        "std": _round(values.std(), 2),
+        **{f"p{p}": _round(v, 2) for p, v in zip(_PERCENTILES, pct)},
+    }
+
+
+def _group_accuracy(correct: np.ndarray, labels: List[Optional[str]]) -> Dict[str, Dict[str, Any]]:
+    groups: Dict[str, List[int]] = {}
+    for j, label in enumerate(labels):
+        if label:
+            groups.setdefault(label, []).append(j)
+    return {
+        label: {"questions": len(cols), **_distribution(correct[:, cols].mean(axis=1) * 100)}
+        for label, cols in groups.items()
+    }
+
+
+def analyze_cohort(answer_key: List[QuestionKey], submissions: Iterable[Dict[str, str]]) -> Dict[str, Any]:
+    """
+    Classical item analysis of one test over many submissions (student_answers dicts),
+    computed on a students x questions matrix of answer codes:
+    - p_value: share of students answering the item correctly (difficulty)
+    - discrimination: point-biserial correlation between the item and the rest score
+    - distractors: share of students choosing each answer (blank included)
+    - skills/topics: distribution of per-student accuracy over the items of each group
+    - reliability_kr20: Kuder-Richardson 20 over the whole test
+    Items are flagged when too hard/easy, poorly or negatively discriminating, or when a
+    wrong answer is chosen more often than the key (often a wrong key or an ambiguous item).
+    """
+    ids = [str(q.id) for q in answer_key]
+    choices = _ChoiceCodes()
+    flat = np.fromiter(
+        itertools.chain.from_iterable(map(choices.__getitem__, map(answers.get, ids)) for answers in submissions),
+        dtype=np.int32,
+    )
+    k = len(ids)
+    n = flat.size // k if k else 0
+    result: Dict[str, Any] = {"submissions": n, "questions": k, "reliability_kr20": None,
+                              "score": {}, "items": [], "skills": {}, "topics": {}, "flagged": []}
+    if not n:
+        return result
+
+    codes = flat.reshape(n, k)
+    # -1 when nobody chose the key: the item then simply has no correct answers
+    key_codes = np.array([choices.labels.get((q.answer or "").strip().upper(), -1) for q in answer_key])
+    correct = (codes == key_codes[None, :]) & (codes != _BLANK_CODE)
+    x = correct.astype(float)
+    scores = x.sum(axis=1)
+
+    p_values = x.mean(axis=0)
+    # item vs. rest of the test, so the item does not correlate with itself
+    rest = scores[:, None] - x
+    cov = (x * rest).mean(axis=0) - p_values * rest.mean(axis=0)
+    spread = x.std(axis=0) * rest.std(axis=0)
+    discrimination = np.divide(cov, spread, out=np.full(k, np.nan), where=spread > 0)
+
+    score_var = scores.var()
+    if k > 1 and score_var > 0:
+        result["reliability_kr20"] = _round(k / (k - 1) * (1 - (p_values * (1 - p_values)).sum() / score_var))
+
+    # choice counts for every (question, answer) pair in one bincount
+    v = len(choices.labels)
+    counts = np.bincount((codes + np.arange(k)[None, :] * v).ravel(), minlength=k * v).reshape(k, v)
+    labels = [label or BLANK for label in choices.labels]
+    wrong_choice = (np.arange(v)[None, :] != key_codes[:, None]) & (np.arange(v)[None, :] != _BLANK_CODE)
+    top_distractor = np.where(wrong_choice, counts, 0).max(axis=1)
+    key_counts = correct.sum(axis=0)
+
+    for j, q in enumerate(answer_key):
+        row = counts[j]
+        flags = []
+        if p_values[j] < ITEM_P_VALUE_MIN:
+            flags.append("too_hard")
+        if p_values[j] > ITEM_P_VALUE_MAX:
+            flags.append("too_easy")
+        if np.isfinite(discrimination[j]):
+            if discrimination[j] < 0:
+                flags.append("negative_discrimination")
+            elif discrimination[j] < ITEM_DISCRIMINATION_MIN:
+                flags.append("low_discrimination")
+        if top_distractor[j] > key_counts[j]:
+            flags.append("distractor_beats_key")
+        result["items"].append({
+            "id": q.id,
+            "skill": q.skill,
+            "topic": q.topic,
+            "p_value": _round(p_values[j]),
+            "discrimination": _round(discrimination[j]),
+            "distractors": {labels[c]: _round(row[c] / n) for c in np.flatnonzero(row)},
+            "flags": flags,
+        })
+        if flags:
+            result["flagged"].append(q.id)
+
+    result["score"] = _distribution(scores)
+    result["skills"] = _group_accuracy(correct, [q.skill for q in answer_key])
+    result["topics"] = _group_accuracy(correct, [q.topic for q in answer_key])
+    return result
@@ -0,0 +1,107 @@
+import json
+from typing import Any, Dict, List, Optional
+
+
+class QuestionStreamParser:
+    """
+    Incrementally parses a streamed `{"status": ..., "data": [ {...}, {...} ]}` document
+    and returns each question object of the `data` array as soon as its closing brace
+    arrives. Text outside the JSON (code fences, a leading "json" hint) is ignored.
+    """
+
+    def __init__(self, array_key: str = "data"):
+        self.array_key = array_key
+        self._chunks: List[str] = []
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._key_chars: Optional[List[str]] = None
+        self._last_string: Optional[str] = None
+        self._array_depth: Optional[int] = None
+        self._item_buf: Optional[List[str]] = None
+        self._seg_start = 0
+        self.emitted = 0
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Consume a text chunk and return the question objects it completed."""
+        self._chunks.append(chunk)
+        items: List[Dict[str, Any]] = []
+        # Only the part of the chunk belonging to an open item is copied into _item_buf
+        self._seg_start = 0
+        for i, ch in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._last_string = "".join(self._key_chars)
+                        self._key_chars = None
+                    continue
+                if self._key_chars is not None:
+                    self._key_chars.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                # Remember strings at the top level so we can spot the "data" key
+                self._key_chars = [] if len(self._stack) == 1 else None
+            elif ch in "{[":
+                if ch == "[" and len(self._stack) == 1 and self._last_string == self.array_key:
+                    self._array_depth = len(self._stack) + 1
+                self._stack.append(ch)
+                if ch == "{" and self._array_depth is not None and len(self._stack) == self._array_depth + 1:
+                    self._item_buf = []
+                    self._seg_start = i
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if (ch == "}" and self._item_buf is not None
+                        and len(self._stack) == self._array_depth):
+                    self._item_buf.append(chunk[self._seg_start:i + 1])
+                    item = self._load("".join(self._item_buf))
+                    self._item_buf = None
+                    if item is not None:
+                        items.append(item)
+                elif ch == "]" and self._array_depth is not None and len(self._stack) < self._array_depth:
+                    self._array_depth = None
+            elif ch not in " \t\r\n:,":
+                self._last_string = None if len(self._stack) == 1 else self._last_string
+
+        if self._item_buf is not None:
+            self._item_buf.append(chunk[self._seg_start:])
+        self.emitted += len(items)
+        return items
+
+    def _load(self, text: str) -> Optional[Dict[str, Any]]:
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        return item if isinstance(item, dict) else None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """
+        Called when the stream ends. If nothing was emitted incrementally (e.g. the model
+        returned a bare array), fall back to parsing the whole text once.
+        """
+        if self.emitted:
+            return []
+        text = self.text
+        start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+        if start < 0:
+            return []
+        try:
+            doc = json.loads(text[start:text.rfind("}" if text[start] == "{" else "]") + 1])
+        except json.JSONDecodeError:
+            return []
+        items = doc.get(self.array_key, []) if isinstance(doc, dict) else doc
+        items = [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []
+        self.emitted += len(items)
+        return items
@@ -0,0 +1,90 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple, Union
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Either a fixed label (background work) or the ASGI scope of the HTTP request being
+# served; set by the metrics middleware and inherited by every task it spawns.
+_route: ContextVar[Union[str, Dict[str, Any]]] = ContextVar("route", default="background")
+
+_STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                  1, 2.5, 5, 10, 20, 40, 80, 160)
+_TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+STAGE_SECONDS = Histogram(
+    "studyhub_stage_seconds",
+    "Time spent in one processing stage (prompt_build, network, stream, extract, parse, validate, repair, material_map)",
+    ["stage", "route"],
+    buckets=_STAGE_BUCKETS,
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "studyhub_http_request_seconds",
+    "End-to-end HTTP request latency",
+    ["route", "method", "status"],
+    buckets=_STAGE_BUCKETS,
+)
+GEMINI_CALLS = Counter(
+    "studyhub_gemini_calls_total",
+    "Gemini HTTP calls by outcome (HTTP status, or 'error' for timeouts/network errors)",
+    ["route", "model", "status"],
+)
+GEMINI_TOKENS = Histogram(
+    "studyhub_gemini_tokens",
+    "Tokens per Gemini call from usageMetadata (kind = prompt | output | thoughts)",
+    ["route", "model", "kind"],
+    buckets=_TOKEN_BUCKETS,
+)
+
+_USAGE_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ("prompt", "promptTokenCount"),
+    ("output", "candidatesTokenCount"),
+    ("thoughts", "thoughtsTokenCount"),
+)
+
+
+def set_route(label_or_scope: Union[str, Dict[str, Any]]):
+    _route.set(label_or_scope)
+
+
+def current_route() -> str:
+    """Route template ("/grade/", not the raw path) once the router has matched the request."""
+    value = _route.get()
+    if isinstance(value, dict):
+        return getattr(value.get("route"), "path", None) or "other"
+    return value
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage, current_route()).observe(seconds)
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """`with timed_stage("parse"): ...` records the block's duration, even when it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def record_gemini_call(model: str, status: Optional[int], data: Optional[Dict[str, Any]] = None):
+    route = current_route()
+    GEMINI_CALLS.labels(route, model, str(status) if status is not None else "error").inc()
+    usage = (data or {}).get("usageMetadata") or {}
+    for kind, field in _USAGE_FIELDS:
+        if isinstance(usage.get(field), int):
+            GEMINI_TOKENS.labels(route, model, kind).observe(usage[field])
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Exposition payload; aggregates all workers when PROMETHEUS_MULTIPROC_DIR is set (gunicorn)."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
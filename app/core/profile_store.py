@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+from app.core.storage import SQLiteStore, get_field
+from app.core.token_budget import HISTORY_RECENT_TESTS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LEARNING_PROFILE_PATH = os.getenv("LEARNING_PROFILE_PATH", "data/learning_profiles.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    student_id TEXT PRIMARY KEY,
+    name TEXT,
+    current_level TEXT,
+    study_hours_per_week INTEGER,
+    learning_goals TEXT,
+    learning_preferences TEXT,
+    study_methods TEXT,
+    tests_taken INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    student_id TEXT NOT NULL REFERENCES students (student_id),
+    test_date TEXT NOT NULL,
+    level_at_test TEXT,
+    total_score INTEGER,
+    total_questions INTEGER,
+    skill_summary TEXT,
+    weak_topics TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tests_student ON tests (student_id, test_date);
+
+CREATE TABLE IF NOT EXISTS skill_stats (
+    student_id TEXT NOT NULL,
+    skill TEXT NOT NULL,
+    correct INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_id, skill)
+);
+
+CREATE TABLE IF NOT EXISTS topic_stats (
+    student_id TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_id, topic)
+);
+"""
+
+# Static profile fields kept per student; the history lives in the aggregate tables
+PROFILE_FIELDS = ("name", "current_level", "study_hours_per_week", "learning_goals",
+                  "learning_preferences", "study_methods")
+_JSON_FIELDS = ("learning_preferences", "study_methods")
+
+
+class ProfileStore(SQLiteStore):
+    """
+    SQLite-backed learning profiles keyed by student_id. Each graded test is appended
+    once and folded into running aggregates (test count, per-skill correct/total,
+    weak-topic frequencies), so a summary costs a few indexed reads no matter how long
+    the student's history is.
+    """
+
+    schema = _SCHEMA
+
+    def __init__(self, path: str = LEARNING_PROFILE_PATH):
+        super().__init__(path)
+
+    def upsert_profile(self, student_id: str, fields: Dict[str, Any]):
+        """Create the student or update the given static fields (None values are ignored)."""
+        values = {k: fields.get(k) for k in PROFILE_FIELDS if fields.get(k) is not None}
+        for key in _JSON_FIELDS:
+            if key in values:
+                values[key] = json.dumps(values[key], ensure_ascii=False)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO students (student_id, updated_at) VALUES (?, ?)", (student_id, time.time())
+                )
+                if values:
+                    conn.execute(
+                        f"UPDATE students SET {', '.join(f'{k} = ?' for k in values)}, updated_at = ? "
+                        "WHERE student_id = ?",
+                        (*values.values(), time.time(), student_id),
+                    )
+
+    def get_profile(self, student_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM students WHERE student_id = ?", (student_id,)).fetchone()
+        if row is None:
+            return None
+        profile = {"student_id": student_id, "tests_taken": row["tests_taken"]}
+        for key in PROFILE_FIELDS:
+            value = row[key]
+            profile[key] = json.loads(value) if key in _JSON_FIELDS and value else value
+        return profile
+
+    def record_test(self, student_id: str, test_date: str, level_at_test: Optional[str],
+                    per_question: Iterable[Any], weak_topics: Iterable[str],
+                    skill_summary: Optional[Iterable[Any]] = None,
+                    total_score: Optional[int] = None, total_questions: Optional[int] = None):
+        """
+        Append one graded test and update the aggregates in a single transaction.
+        `per_question` items may be PerQuestionResult models or dicts.
+        """
+        skills: Dict[str, List[int]] = {}
+        for pq in per_question:
+            stats = skills.setdefault(get_field(pq, "skill") or "Unknown", [0, 0])
+            stats[0] += 1 if get_field(pq, "correct") else 0
+            stats[1] += 1
+        weak_topics = [t for t in weak_topics or [] if t]
+        if skill_summary is None:
+            summary = [{"skill": s, "correct": c, "total": n} for s, (c, n) in skills.items()]
+        else:
+            summary = [{"skill": get_field(s, "skill"), "correct": get_field(s, "correct"), "total": get_field(s, "total")}
+                       for s in skill_summary]
+        if total_questions is None:
+            total_questions = sum(n for _, n in skills.values())
+        if total_score is None:
+            total_score = sum(c for c, _ in skills.values())
+
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO students (student_id, updated_at) VALUES (?, ?)", (student_id, now))
+                conn.execute(
+                    "INSERT INTO tests (student_id, test_date, level_at_test, total_score, total_questions, "
+                    "skill_summary, weak_topics, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (student_id, str(test_date), level_at_test, total_score, total_questions,
+                     json.dumps(summary, ensure_ascii=False), json.dumps(weak_topics, ensure_ascii=False), now),
+                )
+                conn.executemany(
+                    "INSERT INTO skill_stats (student_id, skill, correct, total) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (student_id, skill) DO UPDATE SET "
+                    "correct = correct + excluded.correct, total = total + excluded.total",
+                    [(student_id, skill, c, n) for skill, (c, n) in skills.items()],
+                )
+                conn.executemany(
+                    "INSERT INTO topic_stats (student_id, topic, count) VALUES (?, ?, 1) "
+                    "ON CONFLICT (student_id, topic) DO UPDATE SET count = count + 1",
+                    [(student_id, topic) for topic in weak_topics],
+                )
+                conn.execute(
+                    "UPDATE students SET tests_taken = tests_taken + 1, updated_at = ? WHERE student_id = ?",
+                    (now, student_id),
+                )
+
+    def import_history(self, student_id: str, test_history: Iterable[Any]) -> int:
+        """Seed a student from a client-side test_history (only used while the store has none)."""
+        count = 0
+        for test in sorted(test_history, key=lambda t: str(get_field(t, "test_date") or "")):
+            self.record_test(
+                student_id, str(get_field(test, "test_date")), get_field(test, "level_at_test"),
+                get_field(test, "per_question") or [], get_field(test, "weak_topics") or [],
+            )
+            count += 1
+        return count
+
+    def summary(self, student_id: str, recent: int = HISTORY_RECENT_TESTS, top_topics: int = 10) -> Dict[str, Any]:
+        """Same shape as token_budget.summarize_history, read from the aggregates."""
+        with self._lock:
+            conn = self._connect()
+            student = conn.execute("SELECT tests_taken FROM students WHERE student_id = ?", (student_id,)).fetchone()
+            if student is None or not student["tests_taken"]:
+                return {}
+            tests = conn.execute(
+                "SELECT test_date, level_at_test, weak_topics FROM tests WHERE student_id = ? "
+                "ORDER BY test_date DESC, id DESC LIMIT ?",
+                (student_id, recent),
+            ).fetchall()
+            skills = conn.execute(
+                "SELECT skill, correct, total FROM skill_stats WHERE student_id = ?", (student_id,)
+            ).fetchall()
+            topics = conn.execute(
+                "SELECT topic, count FROM topic_stats WHERE student_id = ? ORDER BY count DESC, topic LIMIT ?",
+                (student_id, top_topics),
+            ).fetchall()
+        return {
+            "tests_taken": student["tests_taken"],
+            "recent_tests": [
+                {"date": t["test_date"], "level": t["level_at_test"], "weak_topics": json.loads(t["weak_topics"] or "[]")}
+                for t in tests
+            ],
+            "skill_accuracy": {
+                s["skill"]: {"correct": s["correct"], "total": s["total"], "accuracy": round(s["correct"] / s["total"] * 100, 1)}
+                for s in skills if s["total"]
+            },
+            "frequent_weak_topics": {t["topic"]: t["count"] for t in topics},
+        }
+
+    def history(self, student_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """The last `limit` tests, oldest first, as progress trend points."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT test_date, total_score, total_questions, skill_summary FROM tests WHERE student_id = ? "
+                "ORDER BY test_date DESC, id DESC LIMIT ?",
+                (student_id, limit),
+            ).fetchall()
+        return [
+            {
+                "date": row["test_date"],
+                "correct": row["total_score"] or 0,
+                "total": row["total_questions"] or 0,
+                "skills": {s["skill"]: [s["correct"], s["total"]] for s in json.loads(row["skill_summary"] or "[]")},
+            }
+            for row in reversed(rows)
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._connect()
+            students = conn.execute("SELECT COUNT(*) FROM students").fetchone()[0]
+            tests = conn.execute("SELECT COUNT(*) FROM tests").fetchone()[0]
+        return {"students": students, "tests": tests, "path": self.path}
+
+    async def aupsert_profile(self, *args, **kwargs):
+        return await asyncio.to_thread(self.upsert_profile, *args, **kwargs)
+
+    async def aget_profile(self, *args, **kwargs) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get_profile, *args, **kwargs)
+
+    async def arecord_test(self, *args, **kwargs):
+        return await asyncio.to_thread(self.record_test, *args, **kwargs)
+
+    async def aimport_history(self, *args, **kwargs) -> int:
+        return await asyncio.to_thread(self.import_history, *args, **kwargs)
+
+    async def asummary(self, *args, **kwargs) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.summary, *args, **kwargs)
+
+    async def ahistory(self, *args, **kwargs) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.history, *args, **kwargs)
+
+
+profile_store = ProfileStore()
@@ -0,0 +1,101 @@
+import os
+import hmac
+import time
+import random
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+from fastapi import Request
+from fastapi.responses import HTMLResponse, Response
+
+from app.core.metrics import current_route
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# On-demand profiling: a request carrying `X-Profile: <PROFILE_SECRET>` gets its profile back
+# instead of the normal body. Disabled while the secret is empty.
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+# Fraction of requests profiled continuously; their profiles are written to PROFILE_DIR
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "data/profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+
+# pyinstrument runs one profiler per thread; concurrent requests are not profiled meanwhile
+_active = False
+# (Profiler, SpeedscopeRenderer), imported on the first profiled request so workers boot without it
+_pyinstrument = None
+
+
+def _load_pyinstrument():
+    """pyinstrument classes, or None when it is not installed (profiling is optional)."""
+    global _pyinstrument
+    if _pyinstrument is None:
+        try:
+            from pyinstrument import Profiler
+            from pyinstrument.renderers import SpeedscopeRenderer
+            _pyinstrument = (Profiler, SpeedscopeRenderer)
+        except ImportError:
+            _pyinstrument = ()
+    return _pyinstrument or None
+
+
+def _requested(request: Request) -> bool:
+    token = request.headers.get("x-profile")
+    return bool(PROFILE_SECRET and token and hmac.compare_digest(token, PROFILE_SECRET))
+
+
+def _store(profile: str, route: str, elapsed: float):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{route.strip('/').replace('/', '_') or 'root'}-{int(elapsed * 1000)}ms.speedscope.json"
+    with open(os.path.join(PROFILE_DIR, name), "w", encoding="utf-8") as f:
+        f.write(profile)
+    files = sorted(os.listdir(PROFILE_DIR))
+    for old in files[:max(0, len(files) - PROFILE_MAX_FILES)]:
+        os.remove(os.path.join(PROFILE_DIR, old))
+
+
+async def profile_requests(request: Request, call_next):
+    """
+    HTTP middleware running the whole request (router, grading, Gemini client, renderers)
+    under pyinstrument in async mode, so time spent awaiting Gemini is attributed to the
+    awaiting coroutine. Streaming responses are profiled up to their first byte.
+    """
+    global _active
+    requested = _requested(request)
+    sampled = not requested and PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+    if _active or not (requested or sampled):
+        return await call_next(request)
+    classes = _load_pyinstrument()
+    if classes is None:
+        if requested:
+            logger.warning("X-Profile requested but pyinstrument is not installed")
+        return await call_next(request)
+    Profiler, SpeedscopeRenderer = classes
+
+    _active = True
+    profiler = Profiler(interval=PROFILE_INTERVAL, async_mode="enabled")
+    started = time.perf_counter()
+    profiler.start()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+        _active = False
+    elapsed = time.perf_counter() - started
+
+    if requested:
+        headers = {"X-Profile-Status": str(response.status_code), "X-Profile-Seconds": f"{elapsed:.3f}"}
+        if request.headers.get("x-profile-format", "speedscope").lower() == "html":
+            return HTMLResponse(profiler.output_html(), headers=headers)
+        return Response(profiler.output(renderer=SpeedscopeRenderer()), media_type="application/json",
+                        headers=headers)
+
+    try:
+        await asyncio.to_thread(_store, profiler.output(renderer=SpeedscopeRenderer()), current_route(), elapsed)
+    except OSError as e:
+        logger.warning("Could not store sampled profile: %s", e)
+    return response
@@ -0,0 +1,125 @@
+import os
+import re
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.core.storage import get_field
+
+load_dotenv()
+
+# Only the most recent tests feed the trend
+PROGRESS_MAX_TESTS = int(os.getenv("PROGRESS_MAX_TESTS", "20"))
+# Per-test weight decay for skill ranking (most recent test = 1, previous = decay, ...)
+SKILL_RECENCY_DECAY = float(os.getenv("SKILL_RECENCY_DECAY", "0.85"))
+STRONG_SKILL_ACCURACY = float(os.getenv("STRONG_SKILL_ACCURACY", "75"))
+WEAK_SKILL_ACCURACY = float(os.getenv("WEAK_SKILL_ACCURACY", "60"))
+# Upper bound for predicted_reach_next_level_weeks (also used when there is no progress)
+MAX_WEEKS_TO_NEXT_LEVEL = int(os.getenv("MAX_WEEKS_TO_NEXT_LEVEL", "52"))
+
+# Lower bounds of the TOEIC bands in SCALES_TEXT (A2, B1, B2, C1, C2)
+TOEIC_BANDS = np.array([255, 405, 605, 785, 905])
+
+_DATE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})")
+
+
+def _ordinal(value: Any) -> Optional[int]:
+    match = _DATE.match(str(value or ""))
+    if not match:
+        return None
+    try:
+        return date(*map(int, match.groups())).toordinal()
+    except ValueError:
+        return None
+
+
+def points_from_history(test_history: Iterable[Any]) -> List[Dict[str, Any]]:
+    """Turn client-side TestHistoryItem objects/dicts (with per_question) into trend points."""
+    points = []
+    for test in test_history or []:
+        skills: Dict[str, List[int]] = {}
+        for pq in get_field(test, "per_question") or []:
+            stats = skills.setdefault(get_field(pq, "skill") or "Unknown", [0, 0])
+            stats[0] += 1 if get_field(pq, "correct") else 0
+            stats[1] += 1
+        points.append({
+            "date": str(get_field(test, "test_date") or ""),
+            "correct": sum(c for c, _ in skills.values()),
+            "total": sum(n for _, n in skills.values()),
+            "skills": skills,
+        })
+    return points
+
+
+def point_from_result(result: Any, test_date: Optional[str] = None) -> Dict[str, Any]:
+    """Trend point for a freshly graded GradeResponse (or dict)."""
+    return {
+        "date": test_date or date.today().isoformat(),
+        "correct": get_field(result, "total_score") or 0,
+        "total": get_field(result, "total_questions") or 0,
+        "skills": {get_field(s, "skill"): [get_field(s, "correct"), get_field(s, "total")] for s in get_field(result, "skill_summary") or []},
+    }
+
+
+def _weeks_axis(points: List[Dict[str, Any]]) -> np.ndarray:
+    """Weeks since the first test; falls back to one week per test when dates are unusable."""
+    ordinals = [_ordinal(p["date"]) for p in points]
+    if None in ordinals or len(set(ordinals)) < 2:
+        return np.arange(len(points), dtype=float)
+    days = np.array(ordinals, dtype=float)
+    return (days - days[0]) / 7.0
+
+
+def compute_progress(points: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Deterministic ProgressTrend + weeks-to-next-level from chronological trend points
+    ({"date", "correct", "total", "skills": {skill: [correct, total]}}):
+    - accuracy_growth_rate: least-squares slope of test accuracy, in points per week
+    - consistency_index: 1 / (1 + std of the residuals around that line / 10), in (0, 1]
+    - strong/weak skills: recency-weighted per-skill accuracy against fixed thresholds
+    - predicted weeks: time for the fitted line to reach the next TOEIC band
+    """
+    points = sorted((p for p in points if p.get("total")), key=lambda p: str(p.get("date") or ""))
+    points = points[-PROGRESS_MAX_TESTS:]
+    trend = {"past_tests": len(points), "accuracy_growth_rate": 0.0, "strong_skills": [],
+             "weak_skills": [], "consistency_index": 1.0}
+    if not points:
+        return {"trend": trend, "predicted_reach_next_level_weeks": MAX_WEEKS_TO_NEXT_LEVEL}
+
+    accuracy = np.array([p["correct"] / p["total"] * 100 for p in points], dtype=float)
+    weeks = _weeks_axis(points)
+    slope, fitted_now = 0.0, accuracy[-1]
+    if len(points) >= 2:
+        x = weeks - weeks.mean()
+        slope = float((x * (accuracy - accuracy.mean())).sum() / (x * x).sum())
+        fitted = accuracy.mean() + slope * x
+        fitted_now = fitted[-1]
+        spread = float(np.std(accuracy - fitted)) if len(points) >= 3 else float(np.std(accuracy))
+        trend["consistency_index"] = round(1.0 / (1.0 + spread / 10.0), 3)
+    trend["accuracy_growth_rate"] = round(slope, 3)
+
+    # tests x skills matrices, weighted toward recent tests
+    skills = sorted({s for p in points for s in p["skills"] if s})
+    if skills:
+        correct = np.array([[p["skills"].get(s, [0, 0])[0] or 0 for s in skills] for p in points], dtype=float)
+        total = np.array([[p["skills"].get(s, [0, 0])[1] or 0 for s in skills] for p in points], dtype=float)
+        weights = SKILL_RECENCY_DECAY ** np.arange(len(points) - 1, -1, -1, dtype=float)[:, None]
+        seen = (total * weights).sum(axis=0)
+        skill_acc = np.divide((correct * weights).sum(axis=0) * 100, seen, out=np.zeros(len(skills)), where=seen > 0)
+        order = np.argsort(-skill_acc, kind="stable")
+        trend["strong_skills"] = [skills[i] for i in order if seen[i] > 0 and skill_acc[i] >= STRONG_SKILL_ACCURACY]
+        trend["weak_skills"] = [skills[i] for i in order[::-1] if seen[i] > 0 and skill_acc[i] < WEAK_SKILL_ACCURACY]
+
+    # Accuracy -> TOEIC 10-990, then the first band above the current estimate
+    score_now = 10 + float(np.clip(fitted_now, 0, 100)) * 9.8
+    above = TOEIC_BANDS[TOEIC_BANDS > score_now]
+    if not above.size:
+        weeks_needed = 0
+    elif slope <= 0:
+        weeks_needed = MAX_WEEKS_TO_NEXT_LEVEL
+    else:
+        target_accuracy = (above[0] - 10) / 9.8
+        weeks_needed = int(np.clip(np.ceil((target_accuracy - fitted_now) / slope), 1, MAX_WEEKS_TO_NEXT_LEVEL))
+    return {"trend": trend, "predicted_reach_next_level_weeks": weeks_needed}
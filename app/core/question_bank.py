@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.core.storage import SQLiteStore
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+QUESTION_BANK_PATH = os.getenv("QUESTION_BANK_PATH", "data/question_bank.db")
+
+# Adaptive tests only use items an exact answer check scores fairly: multiple choice, or
+# fill-in-the-blank with a short answer (never essays or rearrange items)
+_SCORABLE = (
+    "(q.qtype IN ('multiple_choice', 'mcq')"
+    " OR (q.qtype = 'fill_in_blank' AND LENGTH(q.answer) <= ?)"
+    " OR ((q.qtype IS NULL OR q.qtype NOT IN ('essay', 'rearrange', 'fill_in_blank'))"
+    " AND q.options IS NOT NULL AND q.options NOT IN ('null', '[]')))"
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    content_hash TEXT NOT NULL UNIQUE,
+    exam_type TEXT NOT NULL COLLATE NOCASE,
+    level TEXT NOT NULL COLLATE NOCASE,
+    theme TEXT COLLATE NOCASE,
+    qtype TEXT COLLATE NOCASE,
+    skill TEXT COLLATE NOCASE,
+    question TEXT NOT NULL,
+    options TEXT,
+    answer TEXT,
+    explanation TEXT,
+    topics TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_questions_lookup ON questions (exam_type, level, qtype, skill);
+CREATE INDEX IF NOT EXISTS idx_questions_theme ON questions (exam_type, level, theme);
+
+CREATE TABLE IF NOT EXISTS question_topics (
+    question_id INTEGER NOT NULL REFERENCES questions (id),
+    topic TEXT NOT NULL COLLATE NOCASE,
+    PRIMARY KEY (topic, question_id)
+);
+
+CREATE TABLE IF NOT EXISTS served (
+    student_id TEXT NOT NULL,
+    question_id INTEGER NOT NULL REFERENCES questions (id),
+    served_at REAL NOT NULL,
+    PRIMARY KEY (student_id, question_id)
+);
+
+-- IRT item parameters for adaptive tests; questions without a row use level-based defaults
+CREATE TABLE IF NOT EXISTS item_params (
+    question_id INTEGER PRIMARY KEY REFERENCES questions (id),
+    a REAL NOT NULL,
+    b REAL NOT NULL,
+    responses INTEGER NOT NULL DEFAULT 0,
+    correct INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def _norm(value: Optional[str]) -> Optional[str]:
+    """Collapse whitespace; comparisons are case-insensitive via COLLATE NOCASE."""
+    if value is None:
+        return None
+    return " ".join(str(value).split()) or None
+
+
+def normalize_level(exam_type: str, level: Optional[str]) -> str:
+    """'TOEIC 405-600', 'toeic 405-600' and '405-600' all map to '405-600'."""
+    level = _norm(level) or "any"
+    prefix = (_norm(exam_type) or "").lower() + " "
+    if level.lower().startswith(prefix):
+        level = level[len(prefix):]
+    return level
+
+
+def content_hash(item: Dict[str, Any]) -> str:
+    """Identity of a question: normalized question text + answer (case-insensitive)."""
+    raw = f"{(_norm(item.get('question')) or '').lower()}|{(_norm(item.get('answer')) or '').lower()}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _as_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return [str(v) for v in value]
+
+
+class QuestionBank(SQLiteStore):
+    """
+    SQLite-backed store of generated questions, indexed by exam_type, level,
+    theme, question type, skill and subtopic, with a per-student served log
+    so the same student is not shown a question twice.
+    """
+
+    schema = _SCHEMA
+
+    def __init__(self, path: str = QUESTION_BANK_PATH):
+        super().__init__(path)
+
+    def add_questions(self, items: List[Dict[str, Any]], exam_type: str, level: Optional[str],
+                      theme: Optional[str] = None) -> List[int]:
+        """Insert generated items (duplicates are ignored) and return their ids in order."""
+        ids = []
+        level = normalize_level(exam_type, level)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for item in items:
+                    if not isinstance(item, dict) or not item.get("question"):
+                        continue
+                    item_hash = content_hash(item)
+                    topics = _as_list(item.get("topic"))
+                    cur = conn.execute(
+                        "INSERT OR IGNORE INTO questions (content_hash, exam_type, level, theme, qtype, skill, "
+                        "question, options, answer, explanation, topics, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            item_hash, _norm(exam_type), level, _norm(theme),
+                            _norm(item.get("type")), _norm(item.get("skill")),
+                            item.get("question"), json.dumps(item.get("options"), ensure_ascii=False),
+                            item.get("answer"), item.get("explanation"),
+                            json.dumps(topics, ensure_ascii=False), time.time(),
+                        ),
+                    )
+                    if cur.rowcount:
+                        qid = cur.lastrowid
+                        conn.executemany(
+                            "INSERT OR IGNORE INTO question_topics (question_id, topic) VALUES (?, ?)",
+                            [(qid, _norm(t)) for t in topics if _norm(t)],
+                        )
+                    else:
+                        qid = conn.execute(
+                            "SELECT id FROM questions WHERE content_hash = ?", (item_hash,)
+                        ).fetchone()["id"]
+                    ids.append(qid)
+        return ids
+
+    def find_questions(self, exam_type: str, level: Optional[str], limit: int,
+                       question_types: Optional[List[str]] = None,
+                       skills: Optional[List[str]] = None,
+                       topics: Optional[List[str]] = None,
+                       theme: Optional[str] = None,
+                       student_id: Optional[str] = None) -> List[Tuple[int, Dict[str, Any]]]:
+        """Return up to `limit` random matching (id, item) pairs not yet served to `student_id`."""
+        if limit <= 0:
+            return []
+        where = ["q.exam_type = ?", "q.level = ?"]
+        args: List[Any] = [_norm(exam_type), normalize_level(exam_type, level)]
+        for column, values in (("q.qtype", question_types), ("q.skill", skills)):
+            values = [_norm(v) for v in values or [] if _norm(v)]
+            if values:
+                where.append(f"{column} IN ({', '.join('?' * len(values))})")
+                args.extend(values)
+        if theme:
+            where.append("q.theme = ?")
+            args.append(_norm(theme))
+        topic_values = [_norm(t) for t in topics or [] if _norm(t)]
+        if topic_values:
+            where.append(
+                f"q.id IN (SELECT question_id FROM question_topics WHERE topic IN ({', '.join('?' * len(topic_values))}))"
+            )
+            args.extend(topic_values)
+        if student_id:
+            where.append("q.id NOT IN (SELECT question_id FROM served WHERE student_id = ?)")
+            args.append(student_id)
+        args.append(limit)
+
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT * FROM questions q WHERE {' AND '.join(where)} ORDER BY RANDOM() LIMIT ?", args
+            ).fetchall()
+        return [(row["id"], self._row_to_item(row)) for row in rows]
+
+    def mark_served(self, student_id: str, question_ids: List[int]):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO served (student_id, question_id, served_at) VALUES (?, ?, ?)",
+                    [(student_id, qid, now) for qid in question_ids],
+                )
+
+    def item_pool(self, exam_type: str, skills: Optional[List[str]] = None,
+                  max_answer_chars: int = 40) -> List[sqlite3.Row]:
+        """(id, level, a, b, responses) of every objectively scorable question of `exam_type`
+        (see _SCORABLE); a/b/responses are NULL until the item has been calibrated."""
+        where = ["q.exam_type = ?", "q.answer IS NOT NULL", "q.answer != ''", _SCORABLE]
+        args: List[Any] = [_norm(exam_type), max_answer_chars]
+        skills = [_norm(s) for s in skills or [] if _norm(s)]
+        if skills:
+            where.append(f"q.skill IN ({', '.join('?' * len(skills))})")
+            args.extend(skills)
+        with self._lock:
+            return self._connect().execute(
+                "SELECT q.id, q.level, p.a, p.b, p.responses FROM questions q "
+                f"LEFT JOIN item_params p ON p.question_id = q.id WHERE {' AND '.join(where)}",
+                args,
+            ).fetchall()
+
+    def served_ids(self, student_id: str) -> List[int]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT question_id FROM served WHERE student_id = ?", (student_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_item(self, question_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM questions WHERE id = ?", (question_id,)).fetchone()
+        return self._row_to_item(row) if row is not None else None
+
+    def record_response(self, question_id: int, a: float, b: float, correct: bool):
+        """Store an item's updated parameters and response counts after an adaptive-test answer."""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT INTO item_params (question_id, a, b, responses, correct) VALUES (?, ?, ?, 1, ?) "
+                    "ON CONFLICT (question_id) DO UPDATE SET a = excluded.a, b = excluded.b, "
+                    "responses = responses + 1, correct = correct + excluded.correct",
+                    (question_id, a, b, int(correct)),
+                )
+
+    @staticmethod
+    def _row_to_item(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "type": row["qtype"],
+            "skill": row["skill"],
+            "topic": json.loads(row["topics"] or "[]"),
+            "question": row["question"],
+            "options": json.loads(row["options"]) if row["options"] else None,
+            "answer": row["answer"],
+            "explanation": row["explanation"],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._connect()
+            total = conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+            served = conn.execute("SELECT COUNT(*) FROM served").fetchone()[0]
+        return {"questions": total, "served": served, "path": self.path}
+
+    async def aadd_questions(self, *args, **kwargs) -> List[int]:
+        return await asyncio.to_thread(self.add_questions, *args, **kwargs)
+
+    async def afind_questions(self, *args, **kwargs) -> List[Tuple[int, Dict[str, Any]]]:
+        return await asyncio.to_thread(self.find_questions, *args, **kwargs)
+
+    async def amark_served(self, *args, **kwargs):
+        return await asyncio.to_thread(self.mark_served, *args, **kwargs)
+
+    async def aitem_pool(self, *args, **kwargs) -> List[sqlite3.Row]:
+        return await asyncio.to_thread(self.item_pool, *args, **kwargs)
+
+    async def aserved_ids(self, *args, **kwargs) -> List[int]:
+        return await asyncio.to_thread(self.served_ids, *args, **kwargs)
+
+    async def aget_item(self, *args, **kwargs) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get_item, *args, **kwargs)
+
+    async def arecord_response(self, *args, **kwargs):
+        return await asyncio.to_thread(self.record_response, *args, **kwargs)
+
+
+async def store_generated(data: Any, exam_type: str, level: Optional[str], theme: Optional[str] = None) -> List[int]:
+    """Best-effort: save the `data` list of a generated test; never fails the request."""
+    items = data.get("data") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return []
+    try:
+        return await question_bank.aadd_questions(items, exam_type, level, theme=theme)
+    except Exception as e:
+        logger.warning("Could not store generated questions in bank: %s", e)
+        return []
+
+
+question_bank = QuestionBank()
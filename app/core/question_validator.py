@@ -0,0 +1,138 @@
+import os
+import re
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.core.metrics import timed_stage
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+QUESTION_REPAIR_ROUNDS = int(os.getenv("QUESTION_REPAIR_ROUNDS", "2"))
+
+# Same mapping the topic prompt asks the model to follow
+SKILL_BY_TYPE = {
+    "multiple_choice": "Grammar",
+    "fill_in_blank": "Grammar",
+    "rearrange": "Grammar",
+    "essay": "Writing",
+}
+MCQ_TYPES = {"multiple_choice", "mcq"}
+
+_LETTER_PREFIX = re.compile(r"^\s*\(?[A-Da-d][\).:]\s+")
+
+RegenerateFn = Callable[[List[Tuple[Dict[str, Any], List[str]]]], Awaitable[List[Dict[str, Any]]]]
+
+
+def _is_mcq(item: Dict[str, Any]) -> bool:
+    return str(item.get("type") or "").strip().lower() in MCQ_TYPES or bool(item.get("options"))
+
+
+def normalize_question(item: Dict[str, Any], skill_by_type: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Apply fixes that don't need the model: topic as a list, skill derived from type,
+    "A. foo" option prefixes removed, and a letter / differently-cased answer mapped
+    onto the matching option text.
+    """
+    item = dict(item)
+    if isinstance(item.get("topic"), str):
+        item["topic"] = [item["topic"]]
+
+    qtype = str(item.get("type") or "").strip().lower()
+    if skill_by_type and qtype in skill_by_type:
+        item["skill"] = skill_by_type[qtype]
+
+    options = item.get("options")
+    answer = item.get("answer")
+    if isinstance(options, list) and all(isinstance(o, str) for o in options):
+        options = [_LETTER_PREFIX.sub("", o).strip() for o in options]
+        item["options"] = options
+        if isinstance(answer, str) and options:
+            answer = answer.strip()
+            if len(answer) == 1 and answer.upper() in "ABCD" and len(options) == 4 and answer not in options:
+                answer = options["ABCD".index(answer.upper())]
+            else:
+                stripped = _LETTER_PREFIX.sub("", answer).strip()
+                for option in options:
+                    if option.lower() == stripped.lower():
+                        answer = option
+                        break
+            item["answer"] = answer
+    return item
+
+
+def validate_question(item: Any,
+                      skill_by_type: Optional[Dict[str, str]] = None,
+                      allowed_skills: Optional[Iterable[str]] = None) -> List[str]:
+    """Return the list of problems with a generated question (empty when valid)."""
+    if not isinstance(item, dict):
+        return ["item is not a JSON object"]
+    errors = []
+    if not str(item.get("question") or "").strip():
+        errors.append("question is empty")
+    answer = item.get("answer")
+    if not str(answer or "").strip():
+        errors.append("answer is empty")
+    if not str(item.get("explanation") or "").strip():
+        errors.append("explanation is empty")
+
+    if _is_mcq(item):
+        options = item.get("options")
+        if not isinstance(options, list) or len(options) != 4:
+            errors.append("options must be a list of exactly 4 answers")
+        elif len({str(o).strip().lower() for o in options}) != 4:
+            errors.append("options must be 4 unique answers")
+        elif answer not in options:
+            errors.append("answer must be exactly one of the options")
+
+    qtype = str(item.get("type") or "").strip().lower()
+    if skill_by_type and qtype in skill_by_type and item.get("skill") != skill_by_type[qtype]:
+        errors.append(f"skill must be {skill_by_type[qtype]} for type {qtype}")
+    if allowed_skills and item.get("skill") not in set(allowed_skills):
+        errors.append(f"skill must be one of {sorted(set(allowed_skills))}")
+    return errors
+
+
+async def validate_and_repair(items: List[Any],
+                              regenerate: RegenerateFn,
+                              skill_by_type: Optional[Dict[str, str]] = None,
+                              allowed_skills: Optional[Iterable[str]] = None,
+                              max_rounds: int = QUESTION_REPAIR_ROUNDS) -> List[Dict[str, Any]]:
+    """
+    Validate every item locally and ask the model to regenerate only the invalid ones,
+    up to `max_rounds` times. Items still invalid afterwards are dropped.
+    """
+    def check(item):
+        if isinstance(item, dict):
+            item = normalize_question(item, skill_by_type)
+        return item, validate_question(item, skill_by_type, allowed_skills)
+
+    with timed_stage("validate"):
+        checked = [check(item) for item in items]
+    items = [item for item, _ in checked]
+    bad = {i: errors for i, (_, errors) in enumerate(checked) if errors}
+
+    for _ in range(max_rounds):
+        if not bad:
+            break
+        indices = sorted(bad)
+        try:
+            with timed_stage("repair"):
+                replacements = await regenerate([(items[i], bad[i]) for i in indices])
+        except Exception as e:
+            logger.warning("Question repair call failed: %s", e)
+            break
+        for i, replacement in zip(indices, replacements):
+            item, errors = check(replacement)
+            items[i] = item
+            if errors:
+                bad[i] = errors
+            else:
+                del bad[i]
+
+    if bad:
+        logger.warning("Dropping %d invalid generated questions: %s", len(bad), list(bad.values())[:3])
+    return [item for i, item in enumerate(items) if i not in bad]
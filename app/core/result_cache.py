@@ -0,0 +1,124 @@
+import os
+import copy
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TEST_CACHE_MAX_ENTRIES = int(os.getenv("TEST_CACHE_MAX_ENTRIES", "256"))
+TEST_CACHE_TTL_SECONDS = float(os.getenv("TEST_CACHE_TTL_SECONDS", "900"))
+
+
+def _normalize(value: Any) -> Any:
+    """Normalize request values so that trivially different payloads share a key."""
+    if isinstance(value, str):
+        return " ".join(value.split()).lower()
+    if isinstance(value, (list, tuple, set)):
+        return sorted((_normalize(v) for v in value), key=lambda v: json.dumps(v, sort_keys=True))
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    return value
+
+
+def make_cache_key(namespace: str, **params: Any) -> str:
+    """
+    Build a stable key from request params: strings are case/whitespace-folded,
+    lists are order-insensitive, and None/empty values are dropped.
+    """
+    cleaned = {k: _normalize(v) for k, v in params.items() if v not in (None, "", [], ())}
+    return f"{namespace}:{json.dumps(cleaned, sort_keys=True, ensure_ascii=False)}"
+
+
+class ResultCache:
+    """
+    In-process LRU + TTL cache with single-flight: concurrent callers asking for the
+    same key while it is being computed await the same task instead of recomputing.
+    """
+
+    def __init__(self, max_entries: int = TEST_CACHE_MAX_ENTRIES, ttl_seconds: float = TEST_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]], fresh: bool = False,
+                             cache_if: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        Return a cached value for `key`, or run `compute()` once and cache the result
+        (unless `cache_if(result)` is false, e.g. for an incomplete test).
+        With fresh=True the cached value is skipped but the new result still refreshes it.
+        Callers always get their own deep copy so mutations don't leak between requests.
+        """
+        if not fresh:
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return copy.deepcopy(value)
+
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                self.coalesced += 1
+                return copy.deepcopy(await asyncio.shield(inflight))
+
+        self.misses += 1
+        # The computation runs as its own task so a disconnecting caller
+        # does not cancel the generation other callers are waiting on.
+        task = asyncio.ensure_future(compute())
+        if not fresh:
+            self._inflight[key] = task
+        task.add_done_callback(lambda t: self._on_done(key, t, cache_if))
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def _on_done(self, key: str, task: asyncio.Future, cache_if: Optional[Callable[[Any], bool]] = None):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        if cache_if is not None and not cache_if(task.result()):
+            return
+        self.set(key, task.result())
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "inflight": len(self._inflight),
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
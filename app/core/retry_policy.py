@@ -0,0 +1,98 @@
+import os
+import time
+import random
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "2"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "0.5"))
+GEMINI_BACKOFF_CAP = float(os.getenv("GEMINI_BACKOFF_CAP", "8"))
+# Retries + hedges may add at most this fraction of extra calls on top of normal traffic...
+GEMINI_RETRY_BUDGET_RATIO = float(os.getenv("GEMINI_RETRY_BUDGET_RATIO", "0.1"))
+# ...plus a small floor so a quiet worker can still retry now and then
+GEMINI_RETRY_BUDGET_MIN_PER_SEC = float(os.getenv("GEMINI_RETRY_BUDGET_MIN_PER_SEC", "0.2"))
+GEMINI_RETRY_BUDGET_MAX = float(os.getenv("GEMINI_RETRY_BUDGET_MAX", "20"))
+
+GEMINI_HEDGING = os.getenv("GEMINI_HEDGING", "1").lower() in ("1", "true", "yes")
+GEMINI_HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95"))
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "2"))
+# No hedging until we have seen this many calls for a model
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+
+
+def backoff_delay(attempt: int, base: float = GEMINI_BACKOFF_BASE, cap: float = GEMINI_BACKOFF_CAP) -> float:
+    """Exponential backoff with full jitter: uniform(0, min(cap, base * 2^attempt))."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RetryBudget:
+    """
+    Token bucket shared by every retry and hedge in the process. Each original call
+    deposits `ratio` tokens, each retry/hedge withdraws one, so during an outage the
+    extra load is capped at roughly `ratio` of the incoming traffic.
+    """
+
+    def __init__(self, ratio: float = GEMINI_RETRY_BUDGET_RATIO,
+                 min_per_sec: float = GEMINI_RETRY_BUDGET_MIN_PER_SEC,
+                 max_tokens: float = GEMINI_RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._last_refill = time.monotonic()
+        self.exhausted = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._last_refill) * self.min_per_sec)
+        self._last_refill = now
+
+    def deposit(self):
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        self._refill()
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        self.exhausted += 1
+        return False
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per model, used to pick the hedge delay."""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, key: str, latency: float):
+        self._samples.setdefault(key, deque(maxlen=self.window)).append(latency)
+
+    def percentile(self, key: str, pct: float) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        """Seconds to wait before hedging, or None when hedging is off / not enough data."""
+        if not GEMINI_HEDGING or len(self._samples.get(key, ())) < GEMINI_HEDGE_MIN_SAMPLES:
+            return None
+        return max(GEMINI_HEDGE_MIN_DELAY, self.percentile(key, GEMINI_HEDGE_PERCENTILE))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            key: {
+                "samples": len(samples),
+                "p50_seconds": round(self.percentile(key, 50), 3),
+                "p95_seconds": round(self.percentile(key, 95), 3),
+            }
+            for key, samples in self._samples.items() if samples
+        }
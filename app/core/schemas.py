@@ -13,11 +13,15 @@ class ProgressTrend(BaseModel):
     consistency_index: float
 
 
+# Trường đánh dấu LOCAL_FIELD được tính ở server (app/core/progress.py), không nằm trong responseSchema gửi Gemini
+LOCAL_FIELD = {"x-local": True}
+
+
 class ProgressSpeed(BaseModel):
     category: str
     description: str
-    trend: ProgressTrend
-    predicted_reach_next_level_weeks: int
+    trend: Optional[ProgressTrend] = Field(default=None, json_schema_extra=LOCAL_FIELD)
+    predicted_reach_next_level_weeks: Optional[int] = Field(default=None, json_schema_extra=LOCAL_FIELD)
     recommendation: str
 
 
@@ -76,6 +80,25 @@ class GradeResponse(BaseModel):
     personalized_plan: Optional[PersonalizedPlan] = None  # 
     current_level: str 
     post_test_level: str
+    # True: hết thời gian / lỗi Gemini, chỉ trả kết quả chấm local
+    enrichment_skipped: bool = Field(default=False, json_schema_extra=LOCAL_FIELD)
+    enrichment_error: Optional[str] = Field(default=None, json_schema_extra=LOCAL_FIELD)
+    # Tham số /generate-test-custom của đề tiếp theo đang được sinh trước (PREFETCH_NEXT_TEST=1)
+    next_test: Optional[Dict[str, Any]] = Field(default=None, json_schema_extra=LOCAL_FIELD)
+
+
+# Phân tích tăng dần: điểm, per_question, skill_summary đã chấm local; Gemini chỉ giải thích câu sai
+class QuestionExplanation(BaseModel):
+    id: int
+    explain: str
+
+
+class GradeAnalysis(BaseModel):
+    explanations: List[QuestionExplanation] = []
+    recommendations: Optional[List[str]] = None
+    personalized_plan: Optional[PersonalizedPlan] = None
+    current_level: Optional[str] = None
+    post_test_level: Optional[str] = None
 
 
 class TestHistoryItem(BaseModel):
@@ -92,7 +115,7 @@ class LearningProfile(BaseModel):
     learning_goals: str
     learning_preferences: List[str]
     study_methods: List[str]
-    test_history: List[TestHistoryItem]
+    test_history: List[TestHistoryItem] = []  # chỉ cần gửi lần đầu; sau đó server giữ lịch sử theo student_id
 
 
 class GradeRequest(BaseModel):
@@ -100,5 +123,42 @@ class GradeRequest(BaseModel):
     answer_key: List[QuestionKey]
     student_answers: Dict[str, str]
     use_gemini: Optional[bool] = False
-    profile: Optional[LearningProfile]
+    profile: Optional[LearningProfile] = None
+    student_id: Optional[str] = None  # dùng hồ sơ lưu trên server thay vì gửi profile đầy đủ
+    latency_budget_ms: Optional[int] = None  # hoặc header X-Latency-Budget-Ms
+
+
+# /grade/batch: dòng NDJSON đầu tiên là đáp án (gửi một lần), mỗi dòng sau là bài làm của một học viên
+class GradeBatchHeader(BaseModel):
+    test_info: Optional[TestInfo] = None
+    answer_key: List[QuestionKey]
+    record: bool = True  # lưu kết quả vào hồ sơ học viên (khi có student_id)
+
+
+class GradeSubmission(BaseModel):
+    student_id: Optional[str] = None
+    student_answers: Dict[str, str]
+    current_level: Optional[str] = None
+
+
+# Phân tích chất lượng câu hỏi trên bài làm của cả nhóm học viên (cùng một đề)
+class CohortAnalysisRequest(BaseModel):
+    test_info: Optional[TestInfo] = None
+    answer_key: List[QuestionKey]
+    submissions: List[Dict[str, str]]  # mỗi phần tử là student_answers của một học viên
+
+
+
+class GeneratedQuestion(BaseModel):
+    type: str
+    skill: Optional[str] = None
+    topic: List[str] = []
+    question: str
+    options: Optional[List[str]] = None
+    answer: str
+    explanation: str
+
 
+class GeneratedTest(BaseModel):
+    status: str = "success"
+    data: List[GeneratedQuestion]
@@ -0,0 +1,42 @@
+import os
+import sqlite3
+import threading
+from typing import Any, Optional
+
+
+def get_field(obj: Any, key: str, default: Any = None) -> Any:
+    """Read `key` from a dict or an attribute of a model (results arrive as either)."""
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    return getattr(obj, key, default)
+
+
+class SQLiteStore:
+    """
+    Base of the SQLite-backed stores: one connection per process, opened lazily
+    (parent directory created, WAL mode, `schema` applied) and shared by the worker
+    threads; `_lock` serializes its use. SQLite is blocking, so each store pairs its
+    methods with `a*` twins that run them through asyncio.to_thread, off the event loop.
+    """
+
+    schema = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.schema)
+            self._migrate(conn)
+            self._conn = conn
+        return self._conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """Schema changes CREATE ... IF NOT EXISTS cannot express (e.g. new columns)."""
@@ -0,0 +1,83 @@
+import os
+import re
+import json
+from functools import lru_cache
+from typing import Any, Dict, Type
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, TypeAdapter
+
+from app.core.schemas import GeneratedTest, GradeAnalysis, GradeResponse, PersonalizedPlan
+
+load_dotenv()
+
+# Ask Gemini for JSON mode + responseSchema instead of free text (set to 0 to disable)
+GEMINI_STRUCTURED_OUTPUT = os.getenv("GEMINI_STRUCTURED_OUTPUT", "1").lower() in ("1", "true", "yes")
+
+# Built once at import: validate_json parses and validates in a single pass in pydantic-core
+GENERATED_TEST_ADAPTER = TypeAdapter(GeneratedTest)
+GRADE_RESPONSE_ADAPTER = TypeAdapter(GradeResponse)
+GRADE_ANALYSIS_ADAPTER = TypeAdapter(GradeAnalysis)
+PERSONALIZED_PLAN_ADAPTER = TypeAdapter(PersonalizedPlan)
+
+_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*\n?|\n?\s*```\s*$")
+
+# OpenAPI subset accepted by Gemini's responseSchema
+_KEPT_KEYS = {"type", "properties", "required", "items", "enum", "description", "nullable"}
+
+
+def strip_code_fences(text: str) -> str:
+    """Remove a surrounding ```json ... ``` fence without touching the JSON itself."""
+    return _FENCE.sub("", text.strip()).strip()
+
+
+def _to_gemini_schema(node: Any, defs: Dict[str, Any]) -> Any:
+    if isinstance(node, list):
+        return [_to_gemini_schema(n, defs) for n in node]
+    if not isinstance(node, dict):
+        return node
+
+    if "$ref" in node:
+        return _to_gemini_schema(defs[node["$ref"].split("/")[-1]], defs)
+
+    # Optional[X] is emitted as anyOf [X, null]
+    variants = node.get("anyOf")
+    if variants:
+        non_null = [v for v in variants if v.get("type") != "null"]
+        out = _to_gemini_schema(non_null[0], defs) if non_null else {"type": "STRING"}
+        if len(non_null) < len(variants):
+            out["nullable"] = True
+        return out
+
+    out: Dict[str, Any] = {}
+    for key, value in node.items():
+        if key not in _KEPT_KEYS:
+            continue
+        if key == "type":
+            out[key] = str(value).upper()
+        elif key == "properties":
+            # Fields computed locally (x-local) are not requested from the model
+            out[key] = {name: _to_gemini_schema(prop, defs) for name, prop in value.items() if not prop.get("x-local")}
+        else:
+            out[key] = _to_gemini_schema(value, defs)
+    return out
+
+
+@lru_cache(maxsize=None)
+def gemini_response_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    """Derive a Gemini responseSchema from a pydantic model ($refs inlined, Optional → nullable,
+    x-local fields dropped)."""
+    schema = model.model_json_schema()
+    return _to_gemini_schema(schema, schema.get("$defs", {}))
+
+
+def generation_config(model: Type[BaseModel]) -> Dict[str, Any]:
+    """generationConfig for JSON mode with a schema, or {} when structured output is disabled."""
+    if not GEMINI_STRUCTURED_OUTPUT:
+        return {}
+    return {"responseMimeType": "application/json", "responseSchema": gemini_response_schema(model)}
+
+
+def loads_lenient(text: str) -> Any:
+    """json.loads after stripping code fences; raises json.JSONDecodeError."""
+    return json.loads(strip_code_fences(text))
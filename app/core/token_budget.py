@@ -0,0 +1,64 @@
+import os
+import math
+import json
+from collections import Counter, defaultdict
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Upper bound for the input prompt of one /grade analysis call
+GRADE_PROMPT_TOKEN_BUDGET = int(os.getenv("GRADE_PROMPT_TOKEN_BUDGET", "6000"))
+# How many past tests are listed one by one; older ones only count in the aggregates
+HISTORY_RECENT_TESTS = int(os.getenv("HISTORY_RECENT_TESTS", "5"))
+
+# Gemini tokenizers average ~4 characters per token for English text
+CHARS_PER_TOKEN = 4.0
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate; good enough to enforce a budget without a tokenizer call."""
+    if not text:
+        return 0
+    # Non-ASCII characters (Vietnamese diacritics, arrows...) usually cost about a token each
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return math.ceil((len(text) - non_ascii) / CHARS_PER_TOKEN) + non_ascii
+
+
+def compact_json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def summarize_history(test_history: List[Dict[str, Any]], recent: int = HISTORY_RECENT_TESTS,
+                      top_topics: int = 10) -> Dict[str, Any]:
+    """
+    Replace the raw test history (every per_question of every test) with aggregates:
+    test count, the last few (date, level, weak topics), per-skill accuracy and the
+    most frequent weak topics across all tests.
+    """
+    if not test_history:
+        return {}
+
+    ordered = sorted(test_history, key=lambda t: str(t.get("test_date") or ""), reverse=True)
+    topic_counts: Counter = Counter()
+    skill_stats: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+    for test in ordered:
+        topic_counts.update(test.get("weak_topics") or [])
+        for pq in test.get("per_question") or []:
+            stats = skill_stats[pq.get("skill") or "Unknown"]
+            stats[0] += 1 if pq.get("correct") else 0
+            stats[1] += 1
+
+    return {
+        "tests_taken": len(ordered),
+        "recent_tests": [
+            {"date": str(t.get("test_date")), "level": t.get("level_at_test"), "weak_topics": t.get("weak_topics") or []}
+            for t in ordered[:recent]
+        ],
+        "skill_accuracy": {
+            skill: {"correct": c, "total": n, "accuracy": round(c / n * 100, 1)}
+            for skill, (c, n) in skill_stats.items() if n
+        },
+        "frequent_weak_topics": dict(topic_counts.most_common(top_topics)),
+    }
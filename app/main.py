@@ -1,8 +1,37 @@
-from fastapi import FastAPI
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import topic_test, custom_test, grader_router
+from app.core.gemini_gateway import gateway
+from app.core.explanation_cache import explanation_cache
+from app.core.gemini_scheduler import SchedulerOverloaded
+from app.core.metrics import HTTP_REQUEST_SECONDS, current_route, render_metrics, set_route
+from app.core.profiling import profile_requests
+from app.core.question_bank import question_bank
+from app.routers import topic_test, custom_test, grader_router, profile_router, analytics_router, adaptive_router
+from app.services import render_topic, render_custom
+from app.services.grading_jobs import grading_jobs
+from app.services.prefetch import prefetcher
+from app.services.warmup import STARTUP_WARMUP, warm_up
 
-app = FastAPI(title="AI English Test Generator")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Mở connection pool dùng chung cho mọi lời gọi Gemini + bật theo dõi event loop
+    await gateway.start()
+    await grading_jobs.start()
+    # Làm nóng trước khi worker nhận request: mở sẵn kết nối TLS tới Gemini, mở SQLite, nạp cache
+    app.state.warmup = await warm_up() if STARTUP_WARMUP else None
+    try:
+        yield
+    finally:
+        await grading_jobs.stop()
+        await gateway.aclose()
+
+
+app = FastAPI(title="AI English Test Generator", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -12,11 +41,62 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profiling (X-Profile + PROFILE_SECRET, hoặc PROFILE_SAMPLE_RATE) chạy bên trong middleware metrics
+app.middleware("http")(profile_requests)
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    # Gắn nhãn route (template, không phải path thật) cho mọi metric đo trong request này
+    set_route(request.scope)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_REQUEST_SECONDS.labels(current_route(), request.method, str(status)).observe(time.perf_counter() - started)
+
+@app.exception_handler(SchedulerOverloaded)
+async def scheduler_overloaded_handler(request: Request, exc: SchedulerOverloaded):
+    # Hàng đợi Gemini đã đầy: trả 503 ngay thay vì để request treo
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # Đăng ký router
 app.include_router(topic_test.router)
 app.include_router(custom_test.router)
 app.include_router(grader_router.router)
+app.include_router(profile_router.router)
+app.include_router(analytics_router.router)
+app.include_router(adaptive_router.router)
 
 @app.get("/")
 async def root():
     return {"message": "AI English Test API is running 🚀"}
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "gemini_gateway": gateway.stats(), "grading_jobs": grading_jobs.stats(),
+            "warmup": getattr(app.state, "warmup", None)}
+
+@app.get("/metrics")
+async def metrics():
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "generate_test": render_topic.test_cache.stats(),
+        "generate_test_custom": render_custom.test_cache.stats(),
+        "explanations": explanation_cache.stats(),
+        "prefetch": prefetcher.stats(),
+    }
+
+@app.get("/question-bank/stats")
+async def question_bank_stats():
+    return await asyncio.to_thread(question_bank.stats)
@@ -0,0 +1,50 @@
+import json
+
+
+def generate_repair_prompt(
+    broken: list,
+    exam_type: str = "TOEIC",
+    level: str = None,
+    extra_rules: str = "",
+):
+    """
+    broken: list of (question_dict, [error messages]) that failed local validation
+    level: score range / current level the original test targeted
+    extra_rules: test-specific rules (e.g. the type → skill mapping)
+    """
+    numbered = "\n".join(
+        f"{i + 1}. Problems: {'; '.join(errors)}\n   Question: {json.dumps(item, ensure_ascii=False)}"
+        for i, (item, errors) in enumerate(broken)
+    )
+
+    return f"""
+You are an English teacher specialized in {exam_type}.
+The following {len(broken)} generated questions (target level: {exam_type} {level or "N/A"}) failed validation.
+Rewrite EACH of them so that every listed problem is fixed, keeping the same type, skill and subtopic.
+
+{numbered}
+
+Rules:
+- Multiple-choice questions must have exactly 4 unique options (raw answers, no numbering or letters),
+  and "answer" must be exactly one of the options.
+- "answer" and "explanation" must not be empty; the explanation must say why the answer is correct.
+{extra_rules}
+Return ONLY valid JSON with exactly {len(broken)} questions, in the same order:
+
+{{
+  "status": "success",
+  "data": [
+    {{
+      "type": "...",
+      "skill": "...",
+      "topic": ["..."],
+      "question": "...",
+      "options": ["option1", "option2", "option3", "option4"],
+      "answer": "the correct option text",
+      "explanation": "Detailed explanation..."
+    }}
+  ]
+}}
+
+DO NOT add extra text, DO NOT use markdown.
+"""
@@ -1,3 +1,6 @@
+DEFAULT_QUESTION_TYPES = ["multiple_choice", "fill_in_blank", "rearrange", "essay"]
+
+
 def generate_test_prompt(
     topic: str,
     question_types: list = None,
@@ -13,7 +16,7 @@ def generate_test_prompt(
     score_range: exam score range (e.g., TOEIC 405-600, IELTS 6.5-7.0)
     """
     if question_types is None:
-        question_types = ["multiple_choice", "fill_in_blank", "rearrange", "essay"]
+        question_types = DEFAULT_QUESTION_TYPES
 
     types_text = {
         "multiple_choice": "Multiple-choice (4 options)",
@@ -0,0 +1,49 @@
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from app.services.adaptive_test import SessionConflict, answer_item, get_session, start_session
+
+router = APIRouter(prefix="/adaptive-test", tags=["Adaptive Test"])
+
+
+class AdaptiveStartRequest(BaseModel):
+    exam_type: str = "TOEIC"
+    start_level: Optional[str] = None  # ví dụ "605-780"; mặc định lấy current_level trong hồ sơ
+    skills: Optional[List[str]] = None  # chỉ lấy câu hỏi thuộc các kỹ năng này
+    student_id: Optional[str] = None
+
+
+class AdaptiveAnswer(BaseModel):
+    question_id: int
+    answer: Optional[str] = None
+
+
+@router.post("/")
+async def start_adaptive_test(req: AdaptiveStartRequest):
+    """
+    Bắt đầu bài kiểm tra thích ứng (CAT) từ ngân hàng câu hỏi, không gọi Gemini: mỗi câu tiếp theo
+    được chọn theo năng lực ước lượng (IRT 2PL) và bài dừng khi sai số chuẩn đủ nhỏ.
+    """
+    try:
+        return await start_session(req.exam_type, req.start_level, req.skills, req.student_id)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.post("/{session_id}/answer")
+async def answer_adaptive_test(session_id: str, req: AdaptiveAnswer):
+    try:
+        view = await answer_item(session_id, req.question_id, req.answer)
+    except SessionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if view is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return view
+
+
+@router.get("/{session_id}")
+async def get_adaptive_test(session_id: str):
+    view = await get_session(session_id)
+    if view is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return view
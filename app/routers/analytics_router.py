@@ -0,0 +1,18 @@
+import asyncio
+from fastapi import APIRouter
+from app.core.item_analysis import analyze_cohort
+from app.core.metrics import timed_stage
+from app.core.schemas import CohortAnalysisRequest
+
+router = APIRouter(prefix="/analytics", tags=["Analytics"])
+
+
+@router.post("/cohort")
+async def cohort_analysis(req: CohortAnalysisRequest):
+    """
+    Phân tích câu hỏi trên bài làm của cả nhóm: độ khó (p-value), độ phân biệt (point-biserial),
+    tỉ lệ chọn từng đáp án, phân bố độ chính xác theo kỹ năng/chủ đề và độ tin cậy KR-20.
+    `flagged` liệt kê các câu nên xem lại (quá khó/dễ, phân biệt kém, đáp án nhiễu được chọn nhiều hơn đáp án đúng).
+    """
+    with timed_stage("item_analysis"):
+        return await asyncio.to_thread(analyze_cohort, req.answer_key, req.submissions)
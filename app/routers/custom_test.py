@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 from pydantic import BaseModel
-from app.services.render_custom import render_test
+from app.services.render_custom import render_test, stream_test
+from app.services.streaming import stream_questions
 
 router = APIRouter(prefix="/generate-test-custom", tags=["Custom Test"])
 
@@ -14,7 +15,16 @@ class CustomRequest(BaseModel):
     question_ratio: str = "MCQ"
     num_questions: int = 15
     time_limit: int | None = 20
+    fresh: bool = False  # True: bỏ qua cache, luôn sinh đề mới
+    use_bank: bool = False  # True: ưu tiên lấy câu hỏi từ ngân hàng câu hỏi
+    student_id: str | None = None  # tránh lặp lại câu đã giao cho học viên này
 
 @router.post("/")
 async def generate_custom(req: CustomRequest):
     return await render_test(**req.dict())
+
+@router.post("/stream")
+async def generate_custom_stream(req: CustomRequest, format: str = "sse"):
+    """Stream từng câu hỏi qua SSE (mặc định) hoặc NDJSON (?format=ndjson)."""
+    params = req.dict(exclude={"fresh", "use_bank", "student_id"})
+    return stream_questions(stream_test(**params), format)
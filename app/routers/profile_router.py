@@ -0,0 +1,35 @@
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from app.core.profile_store import profile_store
+from app.core.schemas import TestHistoryItem
+
+router = APIRouter(prefix="/profiles", tags=["Learning Profile"])
+
+
+class ProfileUpdate(BaseModel):
+    name: Optional[str] = None
+    current_level: Optional[str] = None
+    study_hours_per_week: Optional[int] = None
+    learning_goals: Optional[str] = None
+    learning_preferences: Optional[List[str]] = None
+    study_methods: Optional[List[str]] = None
+    test_history: List[TestHistoryItem] = []  # chỉ dùng để khởi tạo học viên chưa có lịch sử trên server
+
+
+@router.put("/{student_id}")
+async def upsert_profile(student_id: str, req: ProfileUpdate):
+    await profile_store.aupsert_profile(student_id, req.model_dump(exclude={"test_history"}))
+    stored = await profile_store.aget_profile(student_id)
+    if req.test_history and not stored["tests_taken"]:
+        await profile_store.aimport_history(student_id, req.test_history)
+    return await get_profile(student_id)
+
+
+@router.get("/{student_id}")
+async def get_profile(student_id: str):
+    """Hồ sơ + tổng hợp lịch sử (số bài, độ chính xác theo kỹ năng, chủ đề yếu thường gặp)."""
+    profile = await profile_store.aget_profile(student_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return {**profile, "history_summary": await profile_store.asummary(student_id)}
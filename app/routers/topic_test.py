@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 from pydantic import BaseModel
-from app.services.render_topic import render_test
+from app.services.render_topic import render_test, stream_test
+from app.services.streaming import stream_questions
 
 router = APIRouter(prefix="/generate-test", tags=["Test by Topic"])
 
@@ -10,7 +11,16 @@ class TestRequest(BaseModel):
     question_types: list = None
     exam_type: str = "TOEIC"
     score_range: str = None
+    fresh: bool = False  # True: bỏ qua cache, luôn sinh đề mới
+    use_bank: bool = False  # True: ưu tiên lấy câu hỏi từ ngân hàng câu hỏi
+    student_id: str = None  # tránh lặp lại câu đã giao cho học viên này
 
 @router.post("/")
 async def generate_test(req: TestRequest):
     return await render_test(**req.dict())
+
+@router.post("/stream")
+async def generate_test_stream(req: TestRequest, format: str = "sse"):
+    """Stream từng câu hỏi qua SSE (mặc định) hoặc NDJSON (?format=ndjson)."""
+    params = req.dict(exclude={"fresh", "use_bank", "student_id"})
+    return stream_questions(stream_test(**params), format)
@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.core.adaptive import (
+    CAT_DEFAULT_DISCRIMINATION,
+    calibrate_difficulty,
+    estimate_ability,
+    level_to_theta,
+    select_item,
+    should_stop,
+    theta_to_level,
+)
+from app.core.metrics import timed_stage
+from app.core.profile_store import profile_store
+from app.core.question_bank import question_bank
+from app.core.storage import SQLiteStore
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CAT_SESSIONS_PATH = os.getenv("CAT_SESSIONS_PATH", "data/adaptive_sessions.db")
+# Item arrays are cached per (exam_type, skills) and reloaded from the bank after this long
+CAT_POOL_TTL_SECONDS = float(os.getenv("CAT_POOL_TTL_SECONDS", "300"))
+# Longest fill-in-the-blank answer an exact-match check still scores fairly
+CAT_MAX_ANSWER_CHARS = int(os.getenv("CAT_MAX_ANSWER_CHARS", "40"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+_LETTERS = "ABCDEFGH"
+
+
+class SessionConflict(Exception):
+    """The answer does not belong to the session's current item (or the session is over)."""
+
+
+class SessionStore(SQLiteStore):
+    """SQLite-backed adaptive test sessions, so any worker can serve the next item."""
+
+    schema = _SCHEMA
+
+    def __init__(self, path: str = CAT_SESSIONS_PATH):
+        super().__init__(path)
+
+    def save(self, session_id: str, state: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT INTO sessions (id, state, created_at, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                    (session_id, json.dumps(state, ensure_ascii=False), now, now),
+                )
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute("SELECT state FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def asave(self, *args, **kwargs):
+        return await asyncio.to_thread(self.save, *args, **kwargs)
+
+    async def aload(self, *args, **kwargs) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.load, *args, **kwargs)
+
+
+sessions = SessionStore()
+
+
+def _fold(value: Any) -> str:
+    return " ".join(str(value or "").split()).upper()
+
+
+def is_correct(item: Dict[str, Any], given: Optional[str]) -> bool:
+    """Answer check accepting the option text or its letter (A, B, ...) on either side."""
+    given, answer = _fold(given), _fold(item.get("answer"))
+    if not given:
+        return False
+    if given == answer:
+        return True
+    options = [_fold(o) for o in item.get("options") or []]
+    letters = _LETTERS[:len(options)]
+    if len(given) == 1 and given in letters and options[letters.index(given)] == answer:
+        return True
+    return len(answer) == 1 and answer in letters and options[letters.index(answer)] == given
+
+
+class ItemPool:
+    """
+    ids, a, b, responses of one (exam_type, skills) item pool as arrays, built once and kept
+    for CAT_POOL_TTL_SECONDS. Calibration updates made by this process are applied in
+    place; other workers' updates arrive with the next reload.
+    """
+
+    def __init__(self, exam_type: str, rows):
+        self.ids = np.array([row["id"] for row in rows], dtype=np.int64)
+        self.a = np.array([row["a"] if row["a"] is not None else CAT_DEFAULT_DISCRIMINATION for row in rows],
+                          dtype=float)
+        self.b = np.array([row["b"] if row["b"] is not None else level_to_theta(exam_type, row["level"])
+                           for row in rows], dtype=float)
+        self.responses = np.array([row["responses"] or 0 for row in rows], dtype=np.int64)
+        self.index = {qid: i for i, qid in enumerate(self.ids.tolist())}
+        self.loaded_at = time.monotonic()
+
+    def available(self, excluded: List[int]) -> np.ndarray:
+        """Positions of the items not in `excluded`."""
+        if not excluded:
+            return np.arange(len(self.ids))
+        return np.flatnonzero(~np.isin(self.ids, excluded))
+
+    def update(self, question_id: int, a: float, b: float):
+        i = self.index.get(question_id)
+        if i is not None:
+            self.a[i], self.b[i] = a, b
+            self.responses[i] += 1
+
+
+_pools: Dict[Tuple[str, Tuple[str, ...]], ItemPool] = {}
+
+
+def _load_pool(exam_type: str, skills: Optional[List[str]]) -> ItemPool:
+    rows = question_bank.item_pool(exam_type, skills, max_answer_chars=CAT_MAX_ANSWER_CHARS)
+    return ItemPool(exam_type, rows)
+
+
+async def _item_pool(exam_type: str, skills: Optional[List[str]]) -> ItemPool:
+    key = (exam_type, tuple(sorted(skills or [])))
+    pool = _pools.get(key)
+    if pool is None or time.monotonic() - pool.loaded_at > CAT_POOL_TTL_SECONDS:
+        pool = await asyncio.to_thread(_load_pool, exam_type, skills)
+        _pools[key] = pool
+    return pool
+
+
+def _public_item(question_id: int, item: Dict[str, Any]) -> Dict[str, Any]:
+    """What the student sees: no answer, no explanation."""
+    return {"question_id": question_id, **{k: item.get(k) for k in ("type", "skill", "topic", "question", "options")}}
+
+
+def _view(session_id: str, state: Dict[str, Any], item: Optional[Dict[str, Any]] = None,
+          last: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    view = {
+        "session_id": session_id,
+        "status": state["status"],
+        "answered": len(state["items"]),
+        "correct": sum(1 for i in state["items"] if i["correct"]),
+        "theta": round(state["theta"], 3),
+        "standard_error": round(state["se"], 3),
+        **theta_to_level(state["exam_type"], state["theta"]),
+    }
+    if last is not None:
+        view["last"] = last
+    if item is not None:
+        view["item"] = item
+    return view
+
+
+async def _next_item(state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Pick the most informative item not administered in this session nor served to the
+    student before, or finish the session when the stop rule holds.
+    """
+    pool = await _item_pool(state["exam_type"], state.get("skills"))
+    excluded = [item["id"] for item in state["items"]]
+    if state.get("student_id"):
+        excluded += await question_bank.aserved_ids(state["student_id"])
+    with timed_stage("cat_select"):
+        candidates = pool.available(excluded)
+        if should_stop(state["se"], len(state["items"]), len(candidates)):
+            state["status"] = "finished"
+            state["current"] = None
+            return None
+        index = candidates[select_item(state["theta"], pool.a[candidates], pool.b[candidates])]
+    state["current"] = {"id": int(pool.ids[index]), "a": float(pool.a[index]), "b": float(pool.b[index]),
+                        "responses": int(pool.responses[index])}
+    item = await question_bank.aget_item(state["current"]["id"])
+    return _public_item(state["current"]["id"], item)
+
+
+async def start_session(exam_type: str = "TOEIC", start_level: Optional[str] = None,
+                        skills: Optional[List[str]] = None, student_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    New adaptive test over the question bank. The ability prior is centred on `start_level`
+    (a band such as '605-780'; otherwise the stored profile level, else the middle of the scale).
+    """
+    if start_level is None and student_id:
+        profile = await profile_store.aget_profile(student_id)
+        start_level = (profile or {}).get("current_level")
+    prior_mean = level_to_theta(exam_type, start_level)
+    state = {
+        "exam_type": exam_type.upper(),
+        "skills": skills,
+        "student_id": student_id,
+        "prior_mean": prior_mean,
+        "theta": prior_mean,
+        "se": 1.0,
+        "items": [],
+        "current": None,
+        "status": "active",
+    }
+    item = await _next_item(state)
+    if item is None:
+        raise LookupError(f"The question bank has no answerable {exam_type} questions for this test")
+    session_id = uuid.uuid4().hex
+    await sessions.asave(session_id, state)
+    return _view(session_id, state, item)
+
+
+async def get_session(session_id: str) -> Optional[Dict[str, Any]]:
+    state = await sessions.aload(session_id)
+    if state is None:
+        return None
+    item = None
+    if state["current"]:
+        item = _public_item(state["current"]["id"], await question_bank.aget_item(state["current"]["id"]))
+    return _view(session_id, state, item)
+
+
+async def answer_item(session_id: str, question_id: int, answer: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Score the answer to the current item, update the item's difficulty and the ability
+    estimate, then return the next item or the final band once the standard error is
+    below CAT_SE_TARGET (or the item limit / pool is reached). None if the session is unknown.
+    """
+    state = await sessions.aload(session_id)
+    if state is None:
+        return None
+    current = state["current"]
+    if state["status"] != "active" or not current or current["id"] != question_id:
+        raise SessionConflict("This question is not the session's current item")
+
+    item = await question_bank.aget_item(question_id)
+    correct = is_correct(item or {}, answer)
+    new_b = calibrate_difficulty(current["b"], current["a"], state["theta"], correct, current["responses"])
+    for pool in _pools.values():
+        pool.update(question_id, current["a"], new_b)
+    try:
+        await question_bank.arecord_response(question_id, current["a"], new_b, correct)
+    except Exception as e:
+        logger.warning("Could not update item parameters for %s: %s", question_id, e)
+
+    state["items"].append({"id": question_id, "a": current["a"], "b": current["b"], "correct": correct})
+    with timed_stage("cat_select"):
+        state["theta"], state["se"] = estimate_ability(
+            np.array([i["a"] for i in state["items"]]),
+            np.array([i["b"] for i in state["items"]]),
+            np.array([i["correct"] for i in state["items"]]),
+            prior_mean=state["prior_mean"],
+        )
+    next_item = await _next_item(state)
+    await sessions.asave(session_id, state)
+
+    if next_item is None:
+        await _finish(state)
+    last = {"question_id": question_id, "correct": correct,
+            "answer": (item or {}).get("answer"), "explanation": (item or {}).get("explanation")}
+    return _view(session_id, state, next_item, last)
+
+
+async def _finish(state: Dict[str, Any]):
+    """Best-effort: mark the items as served and store the measured level on the profile."""
+    student_id = state.get("student_id")
+    if not student_id:
+        return
+    try:
+        await question_bank.amark_served(student_id, [i["id"] for i in state["items"]])
+        level = theta_to_level(state["exam_type"], state["theta"])["level"]
+        await profile_store.aupsert_profile(student_id, {"current_level": level})
+    except Exception as e:
+        logger.warning("Could not record adaptive test result for %s: %s", student_id, e)
@@ -0,0 +1,297 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import date
+from typing import Any, Dict, Optional, Tuple
+from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+from app.core.schemas import GradeRequest, GradeResponse
+from app.core.grader import CompiledAnswerKey, grade_locally
+from app.core.gemini_client import call_gemini_analysis
+from app.core.gemini_scheduler import Priority
+from app.core.explanation_cache import explanation_cache, explanation_key
+from app.core.material_mapper import get_materials_from_database
+from app.core.metrics import timed_stage
+from app.core.profile_store import profile_store
+from app.core.progress import PROGRESS_MAX_TESTS, compute_progress, point_from_result, points_from_history
+from app.core.schemas import PerQuestionResult, SkillSummary, PersonalizedPlan, ProgressTrend
+from app.services import render_custom
+from app.services.prefetch import PREFETCH_NEXT_TEST, next_test_params, prefetcher
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Default latency budget for /grade when the client sends none (empty = no limit)
+GRADE_LATENCY_BUDGET_MS = int(os.getenv("GRADE_LATENCY_BUDGET_MS") or 0) or None
+# Incremental analysis: Gemini only explains the wrong answers, scoring stays local (0 = legacy full analysis)
+GRADE_INCREMENTAL_ANALYSIS = os.getenv("GRADE_INCREMENTAL_ANALYSIS", "1") != "0"
+
+
+def serialize_profile(profile):
+    if not profile:
+        return {}
+    profile_dict = jsonable_encoder(profile)
+    for item in profile_dict.get("test_history", []):
+        item.pop("score", None)
+        item.pop("notes", None)
+    return profile_dict
+
+
+def student_id_of(req: GradeRequest) -> Optional[str]:
+    return req.student_id or (req.profile.student_id if req.profile else None)
+
+
+async def resolve_profile(req: GradeRequest) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    Profile (without history) and history summary for the analysis prompt.
+    With a student_id the server-side store is the source of truth: a profile sent in the
+    request updates the stored fields, and its test_history only seeds a student the store
+    has no tests for yet. Without one (or if the store fails) the request's profile is used
+    as before and the prompt builder summarizes its test_history (summary None).
+    """
+    student_id = student_id_of(req)
+    if not student_id:
+        return serialize_profile(req.profile), None
+    try:
+        if req.profile:
+            await profile_store.aupsert_profile(
+                student_id, req.profile.model_dump(mode="json", exclude={"student_id", "test_history"})
+            )
+        stored = await profile_store.aget_profile(student_id)
+        if stored is None:
+            return {"student_id": student_id}, {}
+        if req.profile and req.profile.test_history and not stored["tests_taken"]:
+            await profile_store.aimport_history(student_id, req.profile.test_history)
+        summary = await profile_store.asummary(student_id)
+    except Exception as e:
+        logger.warning("Profile store unavailable, using the request profile: %s", e)
+        return serialize_profile(req.profile), None
+    return {k: v for k, v in stored.items() if k != "tests_taken" and v is not None}, summary
+
+
+async def record_result(req: GradeRequest, result: GradeResponse):
+    """Best-effort: append the graded test to the student's stored history."""
+    await record_for(student_id_of(req), result)
+
+
+async def record_for(student_id: Optional[str], result: GradeResponse):
+    if not student_id:
+        return
+    try:
+        await profile_store.arecord_test(
+            student_id, date.today().isoformat(), result.current_level,
+            result.per_question, result.weak_topics, result.skill_summary,
+            total_score=result.total_score, total_questions=result.total_questions,
+        )
+        if result.post_test_level and result.post_test_level != "Unknown":
+            await profile_store.aupsert_profile(student_id, {"current_level": result.post_test_level})
+    except Exception as e:
+        logger.warning("Could not record graded test for %s: %s", student_id, e)
+
+
+async def progress_for(req: GradeRequest, local: GradeResponse) -> Dict[str, Any]:
+    """Trend + weeks-to-next-level over the stored (or shipped) history plus this test."""
+    points = None
+    student_id = student_id_of(req)
+    if student_id:
+        try:
+            points = await profile_store.ahistory(student_id, PROGRESS_MAX_TESTS)
+        except Exception as e:
+            logger.warning("Profile store unavailable for progress trend: %s", e)
+    if points is None:
+        points = points_from_history(req.profile.test_history if req.profile else [])
+    with timed_stage("progress"):
+        return compute_progress(points + [point_from_result(local)])
+
+
+def grade_local(req: GradeRequest, current_level: Optional[str] = None) -> GradeResponse:
+    """Deterministic grading only (no Gemini): score, per_question, skill_summary, weak_topics."""
+    with timed_stage("local_grade"):
+        total_correct, total_qs, per_q, skill_summary, weak_topics = grade_locally(
+            req.answer_key, req.student_answers
+        )
+    return GradeResponse(
+        total_score=total_correct,
+        total_questions=total_qs,
+        per_question=per_q,
+        skill_summary=skill_summary,
+        weak_topics=weak_topics,
+        current_level=current_level or (req.profile.current_level if req.profile else "Unknown"),
+        post_test_level="Unknown"
+    )
+
+
+def grade_compiled(key: CompiledAnswerKey, student_answers: Dict[str, str],
+                   current_level: Optional[str] = None) -> GradeResponse:
+    """grade_local against an answer key compiled once for many submissions (/grade/batch)."""
+    with timed_stage("local_grade"):
+        total_correct, total_qs, per_q, skill_summary, weak_topics = key.grade(student_answers)
+    return GradeResponse(
+        total_score=total_correct,
+        total_questions=total_qs,
+        per_question=per_q,
+        skill_summary=skill_summary,
+        weak_topics=weak_topics,
+        current_level=current_level or "Unknown",
+        post_test_level="Unknown"
+    )
+
+
+async def enrich_with_gemini(req: GradeRequest, local: GradeResponse,
+                             timeout: Optional[float] = None,
+                             priority: Priority = Priority.INTERACTIVE,
+                             profile: Optional[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]] = None) -> GradeResponse:
+    """Run the Gemini analysis and merge it over the local result.
+    `profile` is a resolve_profile result, resolved here when not given."""
+    per_q = local.per_question
+    skill_summary = local.skill_summary
+    weak_topics = local.weak_topics
+
+    profile_dict, history_summary = profile or await resolve_profile(req)
+
+    # Wrong answers other students already made on this question are explained from the cache
+    wrong_keys = {p.id: explanation_key(p.question, p.expected_answer, p.user_answer) for p in per_q if not p.correct}
+    wrong_keys = {qid: key for qid, key in wrong_keys.items() if key}
+    cached: Dict[str, str] = {}
+    if GRADE_INCREMENTAL_ANALYSIS and wrong_keys:
+        try:
+            cached = await explanation_cache.aget_many(wrong_keys.values())
+        except Exception as e:
+            logger.warning("Explanation cache lookup failed: %s", e)
+    cached_ids = {qid for qid, key in wrong_keys.items() if key in cached}
+
+    payload = {
+        "test_info": req.test_info.dict() if req.test_info else {},
+        "answer_key": [q.dict() for q in req.answer_key if q.id not in cached_ids],
+        "student_answers": req.student_answers,
+        "profile": profile_dict
+    }
+    if history_summary is not None:
+        payload["history_summary"] = history_summary
+    progress = await progress_for(req, local)
+    payload["progress_trend"] = progress
+    if GRADE_INCREMENTAL_ANALYSIS:
+        payload["local_result"] = {
+            "total_score": local.total_score,
+            "total_questions": local.total_questions,
+            "skill_summary": [s.dict() for s in local.skill_summary],
+            "weak_topics": local.weak_topics,
+        }
+
+    gemini_resp = await call_gemini_analysis(payload, timeout=timeout, priority=priority)
+
+    with timed_stage("validate"):
+        if "explanations" in gemini_resp:
+            # merge by id into the local results; correct answers keep their local explain
+            explain = {e.get("id"): e.get("explain") for e in gemini_resp["explanations"] if isinstance(e, dict)}
+            fresh = {wrong_keys[qid]: text for qid, text in explain.items() if qid in wrong_keys and text}
+            explain.update({qid: cached[wrong_keys[qid]] for qid in cached_ids})
+            per_q = [p.model_copy(update={"explain": explain[p.id]}) if explain.get(p.id) else p for p in per_q]
+        elif "per_question" in gemini_resp:
+            per_q = [PerQuestionResult(**p) for p in gemini_resp["per_question"]]
+            fresh = {wrong_keys[p.id]: p.explain for p in per_q if p.id in wrong_keys and not p.correct and p.explain}
+        else:
+            fresh = {}
+        if "skill_summary" in gemini_resp:
+            skill_summary = [SkillSummary(**s) for s in gemini_resp["skill_summary"]]
+        if "weak_topics" in gemini_resp:
+            weak_topics = gemini_resp["weak_topics"]
+
+        recommendations = gemini_resp.get("recommendations")
+        personalized_plan_data = gemini_resp.get("personalized_plan")
+        personalized_plan = None
+        if personalized_plan_data:
+            try:
+                personalized_plan = PersonalizedPlan(**personalized_plan_data)
+            except Exception:
+                personalized_plan = personalized_plan_data
+
+        # Trend fields are computed locally, never taken from the model
+        if isinstance(personalized_plan, PersonalizedPlan):
+            personalized_plan.progress_speed.trend = ProgressTrend(**progress["trend"])
+            personalized_plan.progress_speed.predicted_reach_next_level_weeks = progress["predicted_reach_next_level_weeks"]
+        elif isinstance(personalized_plan, dict) and isinstance(personalized_plan.get("progress_speed"), dict):
+            personalized_plan["progress_speed"].update(progress)
+
+    try:
+        await explanation_cache.aput_many(fresh)
+    except Exception as e:
+        logger.warning("Explanation cache update failed: %s", e)
+
+    if personalized_plan:
+        with timed_stage("material_map"):
+            if isinstance(personalized_plan, dict) and "weekly_goals" in personalized_plan:
+                for goal in personalized_plan["weekly_goals"]:
+                    skill_detected = "Grammar"
+                    for s in skill_summary:
+                        if s.skill in goal.get("topic", ""):
+                            skill_detected = s.skill
+                            break
+                    goal["materials"] = get_materials_from_database(skill_detected, weak_topics)
+            else:
+                main_skill = skill_summary[0].skill if skill_summary else "Grammar"
+                materials = get_materials_from_database(main_skill, weak_topics)
+                if hasattr(personalized_plan, "dict"):
+                    personalized_plan = personalized_plan.dict()
+                personalized_plan["materials"] = materials
+
+    return GradeResponse(
+        total_score=gemini_resp.get("total_score", local.total_score),
+        total_questions=gemini_resp.get("total_questions", local.total_questions),
+        per_question=per_q,
+        skill_summary=skill_summary,
+        weak_topics=weak_topics,
+        recommendations=recommendations,
+        personalized_plan=personalized_plan,
+        current_level=gemini_resp.get("current_level", local.current_level),
+        post_test_level=gemini_resp.get("post_test_level", "Unknown")
+    )
+
+
+async def grade(req: GradeRequest, latency_budget_ms: Optional[int] = None) -> GradeResponse:
+    """
+    Local grading, then Gemini enrichment within the latency budget (argument, then
+    req.latency_budget_ms, then GRADE_LATENCY_BUDGET_MS). If the analysis is late or
+    fails, the local result is returned with enrichment_skipped=True.
+    The result is appended to the student's stored history when a student_id is known,
+    and with PREFETCH_NEXT_TEST the student's likely next custom test starts generating.
+    """
+    started = time.perf_counter()
+    profile = await resolve_profile(req)
+    local = grade_local(req, current_level=profile[0].get("current_level"))
+    result = local
+    if req.use_gemini:
+        result = await _enrich_within_budget(req, local, profile, latency_budget_ms, started)
+    await record_result(req, result)
+    return prefetch_next_test(req, result, profile[0])
+
+
+def prefetch_next_test(req: GradeRequest, result: GradeResponse, profile_dict: Dict[str, Any]) -> GradeResponse:
+    """Speculatively generate the next practice test at background priority (opt-in)."""
+    student_id = student_id_of(req)
+    if not PREFETCH_NEXT_TEST or not student_id:
+        return result
+    params = next_test_params(result, profile_dict)
+    if params is None or not prefetcher.schedule(student_id, params, render_custom.prefetch_test):
+        return result
+    return result.model_copy(update={"next_test": {**params, "student_id": student_id}})
+
+
+async def _enrich_within_budget(req: GradeRequest, local: GradeResponse, profile,
+                                latency_budget_ms: Optional[int], started: float) -> GradeResponse:
+    budget_ms = latency_budget_ms or req.latency_budget_ms or GRADE_LATENCY_BUDGET_MS
+    try:
+        if not budget_ms:
+            return await enrich_with_gemini(req, local, profile=profile)
+        remaining = budget_ms / 1000 - (time.perf_counter() - started)
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        return await asyncio.wait_for(enrich_with_gemini(req, local, timeout=remaining, profile=profile), remaining)
+    except asyncio.TimeoutError:
+        error = f"Gemini analysis did not finish within {budget_ms} ms"
+    except Exception as e:
+        error = str(e)
+    logger.warning("Returning local grading only: %s", error)
+    return local.model_copy(update={"enrichment_skipped": True, "enrichment_error": error})
@@ -0,0 +1,93 @@
+import os
+import json
+import logging
+from typing import Any, AsyncIterator
+
+from dotenv import load_dotenv
+from pydantic import ValidationError
+from starlette.requests import ClientDisconnect
+
+from app.core.grader import CompiledAnswerKey
+from app.core.schemas import GradeBatchHeader, GradeSubmission
+from app.services.grading import grade_compiled, record_for
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# A single NDJSON line (one submission) larger than this aborts the batch
+GRADE_BATCH_MAX_LINE_BYTES = int(os.getenv("GRADE_BATCH_MAX_LINE_BYTES", str(1024 * 1024)))
+
+
+def _event(event: str, data: Any) -> str:
+    # Same framing as the NDJSON question streams: {"event": ..., "data": ...} per line
+    return json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+
+
+async def _lines(body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a streamed request body into non-empty lines without buffering the whole upload."""
+    buf = bytearray()
+    async for chunk in body:
+        buf.extend(chunk)
+        start = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end < 0:
+                break
+            line = bytes(buf[start:end]).strip()
+            start = end + 1
+            if line:
+                yield line
+        del buf[:start]
+        if len(buf) > GRADE_BATCH_MAX_LINE_BYTES:
+            raise ValueError(f"NDJSON line exceeds {GRADE_BATCH_MAX_LINE_BYTES} bytes")
+    line = bytes(buf).strip()
+    if line:
+        yield line
+
+
+async def grade_ndjson(body: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Grade a class from an NDJSON body: the first line is a GradeBatchHeader (answer key,
+    sent once and compiled once), every following line a GradeSubmission. One `result`
+    (or `error`) event is emitted per submission as soon as it is graded, then `done`.
+    Submissions are graded locally; nothing but the current line is held in memory.
+    """
+    graded = failed = 0
+    index = 0
+    key = header = None
+    try:
+        async for line in _lines(body):
+            if header is None:
+                try:
+                    header = GradeBatchHeader.model_validate_json(line)
+                except ValidationError as e:
+                    yield _event("error", {"index": 0, "detail": f"Invalid batch header: {e}"})
+                    yield _event("done", {"graded": 0, "failed": 0})
+                    return
+                key = CompiledAnswerKey(header.answer_key)
+                continue
+
+            index += 1
+            try:
+                submission = GradeSubmission.model_validate_json(line)
+            except ValidationError as e:
+                failed += 1
+                yield _event("error", {"index": index, "detail": str(e)})
+                continue
+            result = grade_compiled(key, submission.student_answers, submission.current_level)
+            if header.record:
+                await record_for(submission.student_id, result)
+            graded += 1
+            yield _event("result", {"index": index, "student_id": submission.student_id,
+                                    **result.model_dump(mode="json", exclude_none=True)})
+    except ClientDisconnect:
+        logger.info("Batch upload disconnected after %d submissions", index)
+        return
+    except Exception as e:
+        # Headers are already sent, so errors are reported in-band
+        logger.warning("Batch grading stopped after %d submissions: %s", index, e)
+        yield _event("error", {"index": index, "detail": str(e)})
+    if header is None:
+        yield _event("error", {"index": 0, "detail": "Missing batch header (answer_key line)"})
+    yield _event("done", {"graded": graded, "failed": failed})
@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import socket
+import uuid
+import asyncio
+import logging
+import sqlite3
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import urlsplit
+
+import httpx
+from dotenv import load_dotenv
+
+from app.core.gemini_scheduler import Priority, SchedulerOverloaded
+from app.core.metrics import set_route
+from app.core.schemas import GradeRequest, GradeResponse
+from app.core.storage import SQLiteStore
+from app.services.grading import enrich_with_gemini, grade_local, record_result, resolve_profile
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GRADING_JOBS_PATH = os.getenv("GRADING_JOBS_PATH", "data/grading_jobs.db")
+GRADING_WORKERS = int(os.getenv("GRADING_WORKERS", "4"))
+GRADING_WEBHOOK_TIMEOUT = float(os.getenv("GRADING_WEBHOOK_TIMEOUT", "10"))
+# Webhooks only go to these hosts (comma-separated; ".example.com" also allows subdomains).
+# Empty: webhook_url is rejected. Plain http only with GRADING_WEBHOOK_ALLOW_HTTP=1.
+GRADING_WEBHOOK_ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("GRADING_WEBHOOK_ALLOWED_HOSTS", "").split(",")
+                                 if h.strip()]
+GRADING_WEBHOOK_ALLOW_HTTP = os.getenv("GRADING_WEBHOOK_ALLOW_HTTP", "0") == "1"
+# A running job belongs to its worker for this long; the lease is renewed while it runs,
+# so only jobs of a dead worker expire and get picked up by another one
+GRADING_JOB_LEASE_SECONDS = float(os.getenv("GRADING_JOB_LEASE_SECONDS", "120"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    request TEXT NOT NULL,
+    local_result TEXT,
+    result TEXT,
+    error TEXT,
+    webhook_url TEXT,
+    owner TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+"""
+
+# Columns added after the first release; older job files are migrated on open
+_MIGRATIONS = {"owner": "ALTER TABLE jobs ADD COLUMN owner TEXT",
+               "lease_until": "ALTER TABLE jobs ADD COLUMN lease_until REAL"}
+
+# queued -> running -> done | failed (an overloaded provider sends running back to queued)
+
+# Claimable: queued, or running under a lease that has expired (its worker died)
+_CLAIMABLE = "(status = 'queued' OR (status = 'running' AND COALESCE(lease_until, 0) < ?))"
+
+
+def check_webhook_url(url: str) -> str:
+    """Raise ValueError unless `url` points to an allowed host over https (or allowed http)."""
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme != "https" and not (parts.scheme == "http" and GRADING_WEBHOOK_ALLOW_HTTP):
+        raise ValueError("webhook_url must use https")
+    if parts.username or parts.password:
+        raise ValueError("webhook_url must not contain credentials")
+    if not any(host == allowed or (allowed.startswith(".") and host.endswith(allowed))
+               for allowed in GRADING_WEBHOOK_ALLOWED_HOSTS):
+        raise ValueError("webhook_url host is not in GRADING_WEBHOOK_ALLOWED_HOSTS")
+    return url
+
+
+class JobStore(SQLiteStore):
+    """SQLite-backed job table, so queued jobs survive a worker restart."""
+
+    schema = _SCHEMA
+
+    def __init__(self, path: str = GRADING_JOBS_PATH):
+        super().__init__(path)
+
+    def _migrate(self, conn: sqlite3.Connection):
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, statement in _MIGRATIONS.items():
+            if column not in columns:
+                conn.execute(statement)
+        conn.commit()
+
+    def create(self, job_id: str, request: str, local_result: str, webhook_url: Optional[str]):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT INTO jobs (id, status, request, local_result, webhook_url, created_at, updated_at) "
+                    "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                    (job_id, request, local_result, webhook_url, now, now),
+                )
+
+    def claim(self, job_id: str, owner: str) -> Optional[Dict[str, Any]]:
+        """Atomically mark the job running for `owner`; the row if this caller won it, else None."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute(
+                    f"UPDATE jobs SET status = 'running', owner = ?, lease_until = ?, updated_at = ? "
+                    f"WHERE id = ? AND {_CLAIMABLE}",
+                    (owner, now + GRADING_JOB_LEASE_SECONDS, now, job_id, now),
+                )
+            if cursor.rowcount != 1:
+                return None
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row)
+
+    def renew(self, job_id: str, owner: str) -> bool:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute(
+                    "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                    (time.time() + GRADING_JOB_LEASE_SECONDS, job_id, owner),
+                )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: str, owner: str, status: str, result: Optional[str] = None,
+               error: Optional[str] = None) -> bool:
+        """Store the outcome (`queued` releases the job) unless another worker took it over meanwhile."""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = ?, result = COALESCE(?, result), error = ?, owner = NULL, "
+                    "lease_until = NULL, updated_at = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                    (status, result, error, time.time(), job_id, owner),
+                )
+        return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def orphaned_ids(self) -> List[str]:
+        """
+        Jobs no live worker holds: running under an expired lease, or queued and untouched
+        for a whole lease period (the worker that queued them in memory is gone).
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id FROM jobs WHERE (status = 'running' AND COALESCE(lease_until, 0) < ?) "
+                "OR (status = 'queued' AND updated_at < ?) ORDER BY created_at",
+                (now, now - GRADING_JOB_LEASE_SECONDS),
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+
+class GradingJobQueue:
+    """
+    Bounded pool of background workers running the Gemini analysis for submitted
+    grading jobs. `submit` answers immediately with the local grading result.
+    Several processes share the job file: a job only runs in the worker that claims it,
+    and jobs of a dead process are recovered once their lease expires.
+    """
+
+    def __init__(self, store: JobStore, workers: int = GRADING_WORKERS):
+        self.store = store
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # ids waiting in (or scheduled back into) this process's queue, so recovery skips them
+        self._queued: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._http: Optional[httpx.AsyncClient] = None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._http = httpx.AsyncClient(timeout=GRADING_WEBHOOK_TIMEOUT)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(max(1, self.workers))]
+        self._tasks.append(asyncio.create_task(self._recover()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def submit(self, req: GradeRequest, webhook_url: Optional[str] = None) -> Dict[str, Any]:
+        """Raises ValueError when `webhook_url` is not allowed (see check_webhook_url)."""
+        if webhook_url:
+            check_webhook_url(webhook_url)
+        profile, _ = await resolve_profile(req)
+        local = grade_local(req, current_level=profile.get("current_level"))
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(
+            self.store.create, job_id, req.model_dump_json(), local.model_dump_json(), webhook_url
+        )
+        self._enqueue(job_id)
+        return {"job_id": job_id, "status": "queued", "result": local}
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = await asyncio.to_thread(self.store.get, job_id)
+        if row is None:
+            return None
+        result = row["result"] or row["local_result"]
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "result": json.loads(result) if result else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "queued": self._queue.qsize(), "owner": self.owner}
+
+    async def _recover(self):
+        """Queue orphaned jobs (of this or a dead process) now and every half lease."""
+        while True:
+            try:
+                for job_id in await asyncio.to_thread(self.store.orphaned_ids):
+                    self._enqueue(job_id)
+            except Exception as e:
+                logger.warning("Could not scan for orphaned grading jobs: %s", e)
+            await asyncio.sleep(GRADING_JOB_LEASE_SECONDS / 2)
+
+    def _enqueue(self, job_id: str, delay: float = 0):
+        """Queue `job_id` (after `delay` seconds) unless this process already holds it."""
+        if job_id in self._queued:
+            return
+        self._queued.add(job_id)
+        if delay:
+            asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job_id)
+        else:
+            self._queue.put_nowait(job_id)
+
+    async def _keep_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(GRADING_JOB_LEASE_SECONDS / 3)
+            if not await asyncio.to_thread(self.store.renew, job_id, self.owner):
+                logger.warning("Lost the lease on grading job %s", job_id)
+                return
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                logger.exception("Grading job %s crashed: %s", job_id, e)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        set_route("grading_job")
+        # Another worker may hold the same id in its queue: only the one that claims it runs it
+        row = await asyncio.to_thread(self.store.claim, job_id, self.owner)
+        if row is None:
+            return
+
+        req = GradeRequest.model_validate_json(row["request"])
+        local = GradeResponse.model_validate_json(row["local_result"])
+        lease = asyncio.create_task(self._keep_lease(job_id))
+        try:
+            enriched = await enrich_with_gemini(req, local, priority=Priority.BULK)
+        except SchedulerOverloaded as e:
+            # Provider is saturated: put the job back instead of failing it
+            if await asyncio.to_thread(self.store.finish, job_id, self.owner, "queued"):
+                self._enqueue(job_id, e.retry_after)
+            return
+        except Exception as e:
+            if not await asyncio.to_thread(self.store.finish, job_id, self.owner, "failed", None, str(e)):
+                return
+            await record_result(req, local)
+        else:
+            if not await asyncio.to_thread(self.store.finish, job_id, self.owner, "done", enriched.model_dump_json()):
+                logger.warning("Grading job %s was taken over by another worker; result dropped", job_id)
+                return
+            await record_result(req, enriched)
+        finally:
+            lease.cancel()
+
+        if row["webhook_url"]:
+            await self._notify(row["webhook_url"], await self.get(job_id))
+
+    async def _notify(self, url: str, job: Optional[Dict[str, Any]]):
+        try:
+            # re-checked: the job may predate a change of the allow-list
+            check_webhook_url(url)
+        except ValueError as e:
+            logger.warning("Webhook %s not sent: %s", url, e)
+            return
+        try:
+            resp = await self._http.post(url, json=job)
+            resp.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning("Webhook %s failed: %s", url, e)
+
+
+grading_jobs = GradingJobQueue(JobStore())
@@ -0,0 +1,176 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.core.gemini_scheduler import SchedulerOverloaded
+from app.core.metrics import set_route
+from app.core.result_cache import make_cache_key
+from app.core.storage import get_field
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: after /grade, generate the student's likely next custom test in the background
+PREFETCH_NEXT_TEST = os.getenv("PREFETCH_NEXT_TEST", "0") == "1"
+PREFETCH_TTL_SECONDS = float(os.getenv("PREFETCH_TTL_SECONDS", "1800"))
+PREFETCH_NUM_QUESTIONS = int(os.getenv("PREFETCH_NUM_QUESTIONS", "15"))
+# Spend cap: speculative generations started per rolling hour, and running at once
+PREFETCH_MAX_PER_HOUR = int(os.getenv("PREFETCH_MAX_PER_HOUR", "100"))
+PREFETCH_MAX_INFLIGHT = int(os.getenv("PREFETCH_MAX_INFLIGHT", "4"))
+# Skills below this accuracy (%) are what the next test practices
+PREFETCH_WEAK_ACCURACY = float(os.getenv("PREFETCH_WEAK_ACCURACY", "60"))
+
+SKILLS = ("Grammar", "Vocabulary", "Reading", "Listening", "Speaking", "Writing")
+
+
+def next_test_params(result: Any, profile: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    The /generate-test-custom request a student most likely sends after this result:
+    the weak topics (grader format "Skill - Topic"), the skills under PREFETCH_WEAK_ACCURACY
+    (weakest first; else the profile's preferred skills), at the post-test level when known.
+    """
+    profile = profile or {}
+    level = get_field(result, "post_test_level")
+    if not level or level == "Unknown":
+        level = get_field(result, "current_level") or profile.get("current_level")
+    if not level or level == "Unknown":
+        return None
+
+    summary = sorted(get_field(result, "skill_summary") or [], key=lambda s: get_field(s, "accuracy") or 0)
+    weak_skills = [get_field(s, "skill") for s in summary if (get_field(s, "accuracy") or 0) < PREFETCH_WEAK_ACCURACY]
+    if not weak_skills:
+        preferences = " ".join(profile.get("learning_preferences") or []).lower()
+        weak_skills = [skill for skill in SKILLS if skill.lower() in preferences]
+    topics = []
+    for weak in get_field(result, "weak_topics") or []:
+        topic = weak.split(" - ", 1)[-1].strip()
+        if topic and topic not in topics:
+            topics.append(topic)
+
+    return {
+        "current_level": level,
+        "toeic_score": None,
+        "weak_skills": [s for s in weak_skills if s and s != "Unknown"] or None,
+        "exam_type": "IELTS" if "ielts" in level.lower() else "TOEIC",
+        "topics": topics or None,
+        "difficulty": None,
+        "question_ratio": "MCQ",
+        "num_questions": PREFETCH_NUM_QUESTIONS,
+        "time_limit": 20,
+    }
+
+
+def prefetch_key(params: Dict[str, Any]) -> str:
+    return make_cache_key("custom", **params)
+
+
+class Prefetcher:
+    """
+    One speculative test per student, generated at Priority.BACKGROUND and kept for
+    PREFETCH_TTL_SECONDS. A matching /generate-test-custom (same normalized params) takes
+    it, awaiting the generation if it is still running. Entries live in this process only.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[float, str, asyncio.Future]] = {}
+        self._started: Deque[float] = deque()
+        self.scheduled = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def _inflight(self) -> int:
+        return sum(1 for _, _, task in self._entries.values() if not task.done())
+
+    def _purge(self, now: float):
+        for student_id, (expires_at, _, task) in list(self._entries.items()):
+            if expires_at < now:
+                del self._entries[student_id]
+                task.cancel()
+                self.expired += 1
+        while self._started and self._started[0] < now - 3600:
+            self._started.popleft()
+
+    def schedule(self, student_id: str, params: Dict[str, Any],
+                 generate: Callable[[Dict[str, Any]], Awaitable[Any]]) -> bool:
+        """Start generating `params` for the student unless the spend cap is reached."""
+        now = time.monotonic()
+        self._purge(now)
+        key = prefetch_key(params)
+        current = self._entries.get(student_id)
+        if current is not None and current[1] == key:
+            return True
+        if len(self._started) >= PREFETCH_MAX_PER_HOUR or self._inflight() >= PREFETCH_MAX_INFLIGHT:
+            self.skipped += 1
+            return False
+        if current is not None:
+            current[2].cancel()
+
+        task = asyncio.ensure_future(self._generate(generate, params))
+        task.add_done_callback(lambda t: self._on_done(student_id, t))
+        self._entries[student_id] = (now + PREFETCH_TTL_SECONDS, key, task)
+        self._started.append(now)
+        self.scheduled += 1
+        return True
+
+    @staticmethod
+    async def _generate(generate: Callable[[Dict[str, Any]], Awaitable[Any]], params: Dict[str, Any]) -> Any:
+        # The task inherits the /grade request's context: label its metrics separately
+        set_route("prefetch")
+        return await generate(params)
+
+    def _on_done(self, student_id: str, task: asyncio.Future):
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is None:
+            return
+        entry = self._entries.get(student_id)
+        if entry is not None and entry[2] is task:
+            del self._entries[student_id]
+        self.failed += 1
+        level = logging.INFO if isinstance(error, SchedulerOverloaded) else logging.WARNING
+        logger.log(level, "Speculative test for %s failed: %s", student_id, error)
+
+    async def take(self, student_id: str, params: Dict[str, Any]) -> Optional[Any]:
+        """The prefetched test if it matches `params` (consumed on use), else None."""
+        self._purge(time.monotonic())
+        entry = self._entries.get(student_id)
+        if entry is None or entry[1] != prefetch_key(params):
+            if entry is not None:
+                self.misses += 1
+            return None
+        del self._entries[student_id]
+        try:
+            data = await asyncio.shield(entry[2])
+        except Exception:
+            return None
+        self.hits += 1
+        return data
+
+    def stats(self) -> Dict[str, Any]:
+        self._purge(time.monotonic())
+        return {
+            "enabled": PREFETCH_NEXT_TEST,
+            "entries": len(self._entries),
+            "inflight": self._inflight(),
+            "started_last_hour": len(self._started),
+            "max_per_hour": PREFETCH_MAX_PER_HOUR,
+            "scheduled": self.scheduled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "failed": self.failed,
+            "skipped": self.skipped,
+        }
+
+
+prefetcher = Prefetcher()
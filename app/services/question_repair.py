@@ -0,0 +1,92 @@
+import json
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from pydantic import ValidationError
+from app.core.gemini_gateway import gateway
+from app.core.gemini_router import ModelTier
+from app.core.gemini_scheduler import Priority
+from app.core.json_stream import QuestionStreamParser
+from app.core.question_validator import RegenerateFn, normalize_question, validate_question, validate_and_repair
+from app.core.schemas import GeneratedTest
+from app.core.structured_output import GENERATED_TEST_ADAPTER, generation_config, loads_lenient
+from app.prompts.prompt_repair import generate_repair_prompt
+
+
+def make_regenerator(exam_type: str, level: str = None, extra_rules: str = "",
+                     tier: ModelTier = ModelTier.FAST, priority: Priority = Priority.BULK) -> RegenerateFn:
+    """Build the callback validate_and_repair uses to re-ask Gemini for only the broken items
+    (a handful of questions, so the fast tier by default)."""
+
+    async def regenerate(broken: List[Tuple[Dict[str, Any], List[str]]]) -> List[Dict[str, Any]]:
+        prompt = generate_repair_prompt(broken, exam_type=exam_type, level=level, extra_rules=extra_rules)
+        text = await gateway.generate_text(prompt, tier=tier, generation_config=generation_config(GeneratedTest),
+                                           priority=priority)
+        parser = QuestionStreamParser()
+        return parser.feed(text) + parser.finish()
+
+    return regenerate
+
+
+def salvage_questions(text: str) -> List[Dict[str, Any]]:
+    """When the whole document is not valid JSON, keep every question object that parses on its own."""
+    parser = QuestionStreamParser()
+    return parser.feed(text) + parser.finish()
+
+
+def parse_generated_test(text: str, num_questions: int) -> Dict[str, Any]:
+    """
+    Parse a generated test. Well-formed output (the norm in JSON mode) goes through the
+    precompiled TypeAdapter in one pass; anything else falls back to a lenient json.loads
+    and, if the document itself is broken, to per-question salvage. A salvaged test says
+    how many questions never arrived in "missing": those are generated afresh with the
+    normal prompt (the repair prompt only fixes questions that exist).
+    Raises json.JSONDecodeError when nothing can be recovered.
+    """
+    try:
+        return GENERATED_TEST_ADAPTER.validate_json(text).model_dump()
+    except ValidationError:
+        pass
+    try:
+        data = loads_lenient(text)
+    except json.JSONDecodeError:
+        salvaged = salvage_questions(text)
+        if not salvaged:
+            raise
+        return {"status": "success", "data": salvaged, "missing": max(0, num_questions - len(salvaged))}
+    if isinstance(data, list):
+        data = {"status": "success", "data": data}
+    return data
+
+
+async def iter_valid_questions(chunks: AsyncIterator[str], regenerate: RegenerateFn,
+                               skill_by_type: Optional[Dict[str, str]] = None,
+                               allowed_skills: Optional[Iterable[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Parse a streamed test and yield each valid question as soon as it is complete.
+    Invalid ones are held back and repaired in a single call once the stream ends.
+    """
+    parser = QuestionStreamParser()
+    broken = []
+    emitted = 0
+
+    async def parsed():
+        async for chunk in chunks:
+            for item in parser.feed(chunk):
+                yield item
+        for item in parser.finish():
+            yield item
+
+    async for item in parsed():
+        item = normalize_question(item, skill_by_type)
+        if validate_question(item, skill_by_type, allowed_skills):
+            broken.append(item)
+            continue
+        emitted += 1
+        yield item
+
+    if broken:
+        for item in await validate_and_repair(broken, regenerate, skill_by_type, allowed_skills):
+            emitted += 1
+            yield item
+
+    if not emitted:
+        raise ValueError(f"No valid question could be parsed from the Gemini stream:\n{parser.text[:2000]}")
@@ -1,20 +1,27 @@
 # render_service.py
 
-import os
 import json
-import asyncio
 from dotenv import load_dotenv
-from google import genai
+from app.core.gemini_gateway import gateway
+from app.core.gemini_router import tier_for_questions
+from app.core.metrics import timed_stage
+from app.core.gemini_scheduler import Priority, SchedulerOverloaded
+from app.core.result_cache import ResultCache, make_cache_key
+from app.core.question_bank import question_bank, store_generated
 from app.prompts.prompt_custom import generate_test_prompt
+from app.services.prefetch import prefetcher
+from app.services.sharding import generate_sharded, is_complete, sharded_result, SHARD_SIZE
+from app.services.question_repair import make_regenerator, iter_valid_questions, parse_generated_test
+from app.core.question_validator import validate_and_repair
+from app.core.schemas import GeneratedTest
+from app.core.structured_output import generation_config
 
 load_dotenv()
 
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("You must set GEMINI_API_KEY in your .env file or environment variables.")
-
-model_name = os.getenv("MODEL_NAME", "gemini-2.0-flash")
-client = genai.Client(api_key=api_key)
+# The custom prompt asks for "skill": "Grammar or Vocabulary"; anything else is repaired
+ALLOWED_SKILLS = ("Grammar", "Vocabulary")
+SKILL_RULE = "- Field \"skill\" must be exactly \"Grammar\" or \"Vocabulary\".\n"
+test_cache = ResultCache()
 
 
 async def render_test(
@@ -27,8 +34,11 @@ async def render_test(
     question_ratio: str = "MCQ",
     num_questions: int = 15,
     time_limit: int | None = 20,
+    fresh: bool = False,
+    use_bank: bool = False,
+    student_id: str | None = None,
 ):
-    prompt = generate_test_prompt(
+    params = dict(
         current_level=current_level,
         toeic_score=toeic_score,
         weak_skills=weak_skills,
@@ -39,25 +49,164 @@ async def render_test(
         num_questions=num_questions,
         time_limit=time_limit,
     )
+    # use_bank=True: ghép đề từ ngân hàng câu hỏi, chỉ gọi Gemini cho số câu còn thiếu
+    if use_bank:
+        return await _render_from_bank(params, student_id)
 
-    try:
-        # Dùng asyncio.to_thread để chạy lệnh đồng bộ trong async context
-        response = await asyncio.to_thread(
-            client.models.generate_content,
-            model=model_name,
-            contents=prompt
-        )
+    # Đề đã được sinh trước (speculative) sau khi chấm bài của học viên này
+    if student_id and not fresh:
+        prefetched = await prefetcher.take(student_id, params)
+        if prefetched is not None:
+            return prefetched
+
+    # Các request giống hệt nhau dùng chung một lần sinh đề (fresh=True để bỏ qua cache)
+    return await test_cache.get_or_compute(
+        make_cache_key("custom", **params),
+        lambda: _generate_and_store(params),
+        fresh=fresh,
+        cache_if=is_complete,
+    )
+
+
+async def _generate_and_store(params: dict, priority: Priority = Priority.BULK):
+    data = await _generate_test(priority=priority, **params)
+    await store_generated(data, params["exam_type"], params["current_level"])
+    return data
+
+
+async def prefetch_test(params: dict):
+    """Speculative generation for the prefetcher: background priority, stored in the bank."""
+    return await _generate_and_store(params, priority=Priority.BACKGROUND)
+
+
+async def _render_from_bank(params: dict, student_id: str | None):
+    num_questions = params["num_questions"]
+    found = await question_bank.afind_questions(
+        params["exam_type"], params["current_level"], num_questions,
+        question_types=[params["question_ratio"]],
+        skills=params["weak_skills"],
+        topics=params["topics"],
+        student_id=student_id,
+    )
+    ids = [qid for qid, _ in found]
+    items = [item for _, item in found]
+
+    shortfall = num_questions - len(items)
+    if shortfall > 0:
+        data = await _generate_test(**{**params, "num_questions": shortfall})
+        ids += await store_generated(data, params["exam_type"], params["current_level"])
+        items += data.get("data", [])
 
-        text = response.text.strip()
-        
-        if text.startswith("```"):
-            text = text.strip("`")
-            text = text.replace("json", "", 1).strip()
+    if student_id and ids:
+        await question_bank.amark_served(student_id, ids)
+    return {
+        **sharded_result(items, max(0, num_questions - len(items))),
+        "source": {"bank": len(found), "generated": len(items) - len(found)},
+    }
 
-        data = json.loads(text)
-        return data
 
+async def _generate_test(priority: Priority = Priority.BULK, **params):
+    """
+    Large tests (> SHARD_SIZE questions) are split into concurrent shards;
+    each shard covers an equal share of the requested topics.
+    """
+    if params["num_questions"] <= SHARD_SIZE:
+        return await _generate_batch(priority=priority, **params)
+
+    async def shard(size, topics):
+        data = await _generate_batch(**{**params, "num_questions": size, "topics": topics}, priority=priority)
+        return [item for item in data.get("data", []) if isinstance(item, dict)]
+
+    items, shortfall = await generate_sharded(shard, params["num_questions"], values=params["topics"])
+    return sharded_result(items, shortfall)
+
+
+async def _generate_batch(
+    current_level: str,
+    toeic_score: int | None = None,
+    weak_skills: list[str] | None = None,
+    exam_type: str = "TOEIC",
+    topics: list[str] | None = None,
+    difficulty: str | None = None,
+    question_ratio: str = "MCQ",
+    num_questions: int = 15,
+    time_limit: int | None = 20,
+    priority: Priority = Priority.BULK,
+):
+    with timed_stage("prompt_build"):
+        prompt = generate_test_prompt(
+            current_level=current_level,
+            toeic_score=toeic_score,
+            weak_skills=weak_skills,
+            exam_type=exam_type,
+            topics=topics,
+            difficulty=difficulty,
+            question_ratio=question_ratio,
+            num_questions=num_questions,
+            time_limit=time_limit,
+        )
+
+    try:
+        text = await gateway.generate_text(prompt, tier=tier_for_questions(num_questions), generation_config=generation_config(GeneratedTest),
+                                           priority=priority)
+        with timed_stage("parse"):
+            data = parse_generated_test(text, num_questions)
+        missing = data.pop("missing", 0)
+
+        # Validate locally; only the broken questions go back to Gemini
+        data["data"] = await validate_and_repair(
+            data.get("data", []),
+            make_regenerator(exam_type, current_level, SKILL_RULE, priority=priority),
+            allowed_skills=ALLOWED_SKILLS,
+        )
     except json.JSONDecodeError:
         raise ValueError(f"❌ Failed to parse JSON from Gemini. Raw response:\n{text}")
+    except SchedulerOverloaded:
+        raise
     except Exception as e:
         raise RuntimeError(f"⚠️ Error calling Gemini API: {str(e)}")
+
+    # Truncated output: the questions that never arrived are generated fresh
+    if missing:
+        extra = await _generate_batch(
+            current_level=current_level, toeic_score=toeic_score, weak_skills=weak_skills, exam_type=exam_type,
+            topics=topics, difficulty=difficulty, question_ratio=question_ratio, num_questions=missing,
+            time_limit=time_limit, priority=priority,
+        )
+        data["data"] += extra.get("data", [])
+    return data
+
+
+async def stream_test(
+    current_level: str,
+    toeic_score: int | None = None,
+    weak_skills: list[str] | None = None,
+    exam_type: str = "TOEIC",
+    topics: list[str] | None = None,
+    difficulty: str | None = None,
+    question_ratio: str = "MCQ",
+    num_questions: int = 15,
+    time_limit: int | None = 20,
+):
+    """Streaming variant of render_test: yields each question as soon as Gemini finishes it."""
+    with timed_stage("prompt_build"):
+        prompt = generate_test_prompt(
+            current_level=current_level,
+            toeic_score=toeic_score,
+            weak_skills=weak_skills,
+            exam_type=exam_type,
+            topics=topics,
+            difficulty=difficulty,
+            question_ratio=question_ratio,
+            num_questions=num_questions,
+            time_limit=time_limit,
+        )
+
+    items = []
+    regenerate = make_regenerator(exam_type, current_level, SKILL_RULE)
+    chunks = gateway.stream_text(prompt, tier=tier_for_questions(num_questions), generation_config=generation_config(GeneratedTest))
+    async for item in iter_valid_questions(chunks, regenerate, allowed_skills=ALLOWED_SKILLS):
+        items.append(item)
+        yield item
+
+    await store_generated({"data": items}, exam_type, current_level)
@@ -1,59 +1,171 @@
-import os
 import json
-import re
 from dotenv import load_dotenv
-from google import genai
-from app.prompts.prompt_topic import generate_test_prompt
+from app.core.gemini_gateway import gateway
+from app.core.gemini_router import tier_for_questions
+from app.core.metrics import timed_stage
+from app.core.gemini_scheduler import SchedulerOverloaded
+from app.core.result_cache import ResultCache, make_cache_key
+from app.core.question_bank import question_bank, store_generated
+from app.prompts.prompt_topic import generate_test_prompt, DEFAULT_QUESTION_TYPES
+from app.services.sharding import generate_sharded, is_complete, sharded_result, SHARD_SIZE
+from app.services.question_repair import make_regenerator, iter_valid_questions, parse_generated_test
+from app.core.question_validator import SKILL_BY_TYPE, validate_and_repair
+from app.core.schemas import GeneratedTest
+from app.core.structured_output import generation_config
 
 load_dotenv()
 
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("Bạn phải đặt GEMINI_API_KEY trong .env hoặc biến môi trường")
-
-model_name = os.getenv("MODEL_NAME", "gemini-2.5-flash")
-client = genai.Client(api_key=api_key)
+SKILL_RULE = "- Field \"skill\" must be derived from the type: " + ", ".join(
+    f"{t} → {s}" for t, s in SKILL_BY_TYPE.items()
+) + ".\n"
+test_cache = ResultCache()
 
 
 async def render_test(topic: str,
                       num_questions: int = 10,
                       question_types: list = None,
                       exam_type: str = "TOEIC",
-                      score_range: str = None):
+                      score_range: str = None,
+                      fresh: bool = False,
+                      use_bank: bool = False,
+                      student_id: str = None):
+    """
+    Đề giống nhau (cùng topic, exam_type, score_range, num_questions, question_types)
+    dùng chung cache; fresh=True để bỏ qua cache và sinh đề mới.
+    use_bank=True: lấy câu hỏi từ ngân hàng câu hỏi trước, chỉ gọi Gemini cho phần còn thiếu.
+    """
+    if use_bank:
+        return await _render_from_bank(topic, num_questions, question_types, exam_type, score_range, student_id)
 
-    prompt = generate_test_prompt(
+    key = make_cache_key(
+        "topic",
         topic=topic,
-        question_types=question_types,
         num_questions=num_questions,
+        question_types=question_types,
         exam_type=exam_type,
-        score_range=score_range
+        score_range=score_range,
+    )
+    return await test_cache.get_or_compute(
+        key,
+        lambda: _generate_and_store(topic, num_questions, question_types, exam_type, score_range),
+        fresh=fresh,
+        cache_if=is_complete,
     )
 
-    try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=prompt
-        )
-        text = response.text.strip()
 
-        # 🧹 Làm sạch kết quả: bỏ ```json ``` hoặc ``` ```
-        clean_text = re.sub(r"^```(?:json)?|```$", "", text, flags=re.MULTILINE).strip()
+async def _generate_and_store(topic, num_questions, question_types, exam_type, score_range):
+    data = await _generate_test(topic, num_questions, question_types, exam_type, score_range)
+    await store_generated(data, exam_type, score_range, theme=topic)
+    return data
+
+
+async def _render_from_bank(topic, num_questions, question_types, exam_type, score_range, student_id):
+    found = await question_bank.afind_questions(
+        exam_type, score_range, num_questions,
+        question_types=question_types, theme=topic, student_id=student_id,
+    )
+    ids = [qid for qid, _ in found]
+    items = [item for _, item in found]
+
+    shortfall = num_questions - len(items)
+    if shortfall > 0:
+        data = await _generate_test(topic, shortfall, question_types, exam_type, score_range)
+        ids += await store_generated(data, exam_type, score_range, theme=topic)
+        items += data.get("data", [])
+
+    if student_id and ids:
+        await question_bank.amark_served(student_id, ids)
+    return {
+        **sharded_result(items, max(0, num_questions - len(items))),
+        "source": {"bank": len(found), "generated": len(items) - len(found)},
+    }
+
+
+async def _generate_test(topic: str,
+                         num_questions: int = 10,
+                         question_types: list = None,
+                         exam_type: str = "TOEIC",
+                         score_range: str = None):
+    """
+    Đề lớn (> SHARD_SIZE câu) được chia thành nhiều phần sinh song song,
+    mỗi phần nhận một nhóm dạng câu hỏi để tổng thể vẫn cân bằng.
+    """
+    if num_questions <= SHARD_SIZE:
+        return await _generate_batch(topic, num_questions, question_types, exam_type, score_range)
+
+    async def shard(size, types):
+        data = await _generate_batch(topic, size, types, exam_type, score_range)
+        return [item for item in data.get("data", []) if isinstance(item, dict)]
+
+    items, shortfall = await generate_sharded(shard, num_questions, values=question_types or DEFAULT_QUESTION_TYPES)
+    return sharded_result(items, shortfall)
 
-        # ✅ Cố gắng parse JSON lần 1
+
+async def _generate_batch(topic: str,
+                          num_questions: int = 10,
+                          question_types: list = None,
+                          exam_type: str = "TOEIC",
+                          score_range: str = None):
+
+    with timed_stage("prompt_build"):
+        prompt = generate_test_prompt(
+            topic=topic,
+            question_types=question_types,
+            num_questions=num_questions,
+            exam_type=exam_type,
+            score_range=score_range
+        )
+
+    try:
+        text = await gateway.generate_text(prompt, tier=tier_for_questions(num_questions), generation_config=generation_config(GeneratedTest))
         try:
-            data = json.loads(clean_text)
-        except json.JSONDecodeError as e:
-            print(f"⚠️ JSONDecodeError lần 1: {e}")
-            # 🩹 Escape dấu ngoặc kép bên trong
-            fixed_text = clean_text.replace('\n', '\\n')
-            fixed_text = re.sub(r'(?<!\\)"(.*?)"(?=\s*[:,}])', lambda m: json.dumps(m.group(1)), fixed_text)
-            try:
-                data = json.loads(fixed_text)
-            except Exception as e2:
-                print("❌ JSONDecodeError lần 2:", e2)
-                raise ValueError(f"Không parse được JSON từ Gemini:\n{clean_text}")
-
-        return data
+            with timed_stage("parse"):
+                data = parse_generated_test(text, num_questions)
+        except json.JSONDecodeError:
+            raise ValueError(f"Không parse được JSON từ Gemini:\n{text}")
+        missing = data.pop("missing", 0)
 
+        # ✅ Kiểm tra từng câu; chỉ gửi lại Gemini những câu bị lỗi
+        data["data"] = await validate_and_repair(
+            data.get("data", []),
+            make_regenerator(exam_type, score_range, SKILL_RULE),
+            skill_by_type=SKILL_BY_TYPE,
+        )
+    except SchedulerOverloaded:
+        raise
     except Exception as e:
         raise RuntimeError(f"Lỗi khi gọi Gemini hoặc xử lý dữ liệu: {str(e)}")
+
+    # Output bị cắt giữa chừng: các câu chưa có được sinh mới bằng prompt thường, không qua prompt sửa lỗi
+    if missing:
+        extra = await _generate_batch(topic, missing, question_types, exam_type, score_range)
+        data["data"] += extra.get("data", [])
+    return data
+
+
+async def stream_test(topic: str,
+                      num_questions: int = 10,
+                      question_types: list = None,
+                      exam_type: str = "TOEIC",
+                      score_range: str = None):
+    """
+    Giống render_test nhưng dùng streaming API của Gemini:
+    yield từng câu hỏi ngay khi Gemini sinh xong câu đó.
+    """
+    with timed_stage("prompt_build"):
+        prompt = generate_test_prompt(
+            topic=topic,
+            question_types=question_types,
+            num_questions=num_questions,
+            exam_type=exam_type,
+            score_range=score_range
+        )
+
+    items = []
+    regenerate = make_regenerator(exam_type, score_range, SKILL_RULE)
+    chunks = gateway.stream_text(prompt, tier=tier_for_questions(num_questions), generation_config=generation_config(GeneratedTest))
+    async for item in iter_valid_questions(chunks, regenerate, skill_by_type=SKILL_BY_TYPE):
+        items.append(item)
+        yield item
+
+    await store_generated({"data": items}, exam_type, score_range, theme=topic)
@@ -0,0 +1,144 @@
+import os
+import math
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.core.question_bank import content_hash
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Tests above SHARD_SIZE questions are split into concurrent Gemini calls
+SHARD_SIZE = int(os.getenv("SHARD_SIZE", "15"))
+SHARD_CONCURRENCY = int(os.getenv("SHARD_CONCURRENCY", "4"))
+# Extra calls made to replace duplicates / failed shards before reporting a shortfall
+SHARD_TOPUP_ROUNDS = int(os.getenv("SHARD_TOPUP_ROUNDS", "3"))
+
+ShardFn = Callable[[int, Optional[List[Any]]], Awaitable[List[Dict[str, Any]]]]
+
+
+def plan_shards(num_questions: int, values: Optional[List[Any]] = None,
+                shard_size: int = SHARD_SIZE) -> List[Tuple[int, Optional[List[Any]]]]:
+    """
+    Split a test into shards of at most ~shard_size questions.
+    `values` (topics or question types) get an equal question quota each, and the
+    quotas are packed into shards so every value ends up with the same share of
+    the test; each shard is told only about the values it has to cover.
+    """
+    n_shards = max(1, math.ceil(num_questions / max(1, shard_size)))
+    if n_shards == 1:
+        return [(num_questions, values)]
+
+    capacity = math.ceil(num_questions / n_shards)
+    values = list(values or [])
+    if len(values) < 2:
+        sizes = [num_questions // n_shards + (1 if i < num_questions % n_shards else 0) for i in range(n_shards)]
+        return [(size, values or None) for size in sizes if size > 0]
+
+    base, extra = divmod(num_questions, len(values))
+    quotas = [(v, base + (1 if i < extra else 0)) for i, v in enumerate(values)]
+
+    shards: List[Tuple[int, Optional[List[Any]]]] = []
+    current: Dict[Any, int] = {}
+    for value, quota in quotas:
+        while quota > 0:
+            take = min(quota, capacity - sum(current.values()))
+            current[value] = current.get(value, 0) + take
+            quota -= take
+            if sum(current.values()) >= capacity:
+                shards.append((sum(current.values()), list(current)))
+                current = {}
+    if current:
+        shards.append((sum(current.values()), list(current)))
+    return shards
+
+
+def dedupe_questions(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Drop repeats of an earlier question (same normalized text and answer, the question
+    bank's identity). Near-identical templates ("If I ___ rich" / "If I ___ time") are
+    different items and are kept.
+    """
+    kept: List[Dict[str, Any]] = []
+    seen = set()
+    for item in items:
+        if not str(item.get("question") or "").strip():
+            continue
+        key = content_hash(item)
+        if key not in seen:
+            seen.add(key)
+            kept.append(item)
+    return kept
+
+
+def sharded_result(items: List[Dict[str, Any]], shortfall: int) -> Dict[str, Any]:
+    """Test document for merged shards; a short test says so instead of claiming success."""
+    if shortfall:
+        return {"status": "partial", "data": items, "shortfall": shortfall}
+    return {"status": "success", "data": items}
+
+
+def is_complete(data: Any) -> bool:
+    """Only complete tests are worth caching."""
+    return not (isinstance(data, dict) and data.get("shortfall"))
+
+
+def interleave(shard_results: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Merge shard outputs round-robin so skills/topics are mixed instead of in blocks."""
+    merged = []
+    for i in range(max((len(r) for r in shard_results), default=0)):
+        for result in shard_results:
+            if i < len(result):
+                merged.append(result[i])
+    return merged
+
+
+async def generate_sharded(generate_shard: ShardFn, num_questions: int,
+                           values: Optional[List[Any]] = None,
+                           shard_size: int = SHARD_SIZE,
+                           concurrency: int = SHARD_CONCURRENCY,
+                           topup_rounds: int = SHARD_TOPUP_ROUNDS) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Run `generate_shard(size, values_subset)` for every shard with at most `concurrency`
+    calls in flight, then merge, dedupe and top up any shortfall with up to `topup_rounds`
+    extra rounds, each sharded the same way. Returns (questions, shortfall): shortfall > 0
+    when the test is still short.
+    A failed shard only costs its own questions; the request fails only if every shard fails.
+    """
+    shards = plan_shards(num_questions, values, shard_size)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(size: int, subset: Optional[List[Any]]):
+        async with semaphore:
+            return await generate_shard(size, subset)
+
+    results = await asyncio.gather(*(run(size, subset) for size, subset in shards), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    ok = [r for r in results if not isinstance(r, BaseException)]
+    if not ok:
+        raise errors[0]
+    for e in errors:
+        logger.warning("Shard generation failed, topping up instead: %s", e)
+
+    items = dedupe_questions(interleave(ok))
+    for _ in range(max(0, topup_rounds)):
+        shortfall = num_questions - len(items)
+        if shortfall <= 0:
+            break
+        # the shortfall can exceed one shard: split it like the first pass, same concurrency cap
+        topups = plan_shards(shortfall, values, shard_size)
+        results = await asyncio.gather(*(run(size, subset) for size, subset in topups), return_exceptions=True)
+        for (size, _), result in zip(topups, results):
+            if isinstance(result, BaseException):
+                logger.warning("Top-up shard for %d questions failed: %s", size, result)
+            else:
+                items = dedupe_questions(items + result)
+
+    shortfall = max(0, num_questions - len(items))
+    if shortfall:
+        logger.warning("Generated test is %d of %d questions short", shortfall, num_questions)
+    return items[:num_questions], shortfall
@@ -0,0 +1,62 @@
+import json
+import logging
+from typing import Any, AsyncIterator, Dict
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+STREAM_FORMATS = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _frame(fmt: str, event: str, data: Any) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {event}\ndata: {payload}\n\n"
+    return json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+
+
+async def _events(items: AsyncIterator[Dict[str, Any]], fmt: str) -> AsyncIterator[str]:
+    count = 0
+    try:
+        async for item in items:
+            yield _frame(fmt, "question", item)
+            count += 1
+    except Exception as e:
+        # Headers are already sent, so errors are reported in-band
+        logger.warning("Streaming generation failed after %d questions: %s", count, e)
+        yield _frame(fmt, "error", {"detail": str(e), "count": count})
+        return
+    yield _frame(fmt, "done", {"status": "success", "count": count})
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose body is produced while the request body is still being read
+    (NDJSON in, NDJSON out). The stock response listens for a disconnect in parallel, and
+    that listener would swallow the remaining request body; here a disconnect surfaces as
+    ClientDisconnect from request.stream() inside the body iterator instead.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+def stream_questions(items: AsyncIterator[Dict[str, Any]], fmt: str = "sse") -> StreamingResponse:
+    """
+    Wrap an async iterator of question dicts as Server-Sent Events (`event: question`)
+    or NDJSON (`{"event": "question", "data": {...}}` per line), ending with a `done` event.
+    """
+    if fmt not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(STREAM_FORMATS)}")
+    return StreamingResponse(
+        _events(items, fmt),
+        media_type=STREAM_FORMATS[fmt],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,60 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict
+
+from dotenv import load_dotenv
+
+from app.core.explanation_cache import explanation_cache
+from app.core.gemini_gateway import gateway
+from app.core.profile_store import profile_store
+from app.core.question_bank import question_bank
+from app.core.schemas import GeneratedTest, GradeAnalysis, GradeResponse, PersonalizedPlan
+from app.core.structured_output import gemini_response_schema
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Prime caches and connections in the lifespan, before the worker accepts traffic
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") == "1"
+
+
+def _prime_local() -> Dict[str, float]:
+    """Blocking part of the warm-up: open the SQLite stores and fill in-process caches."""
+    timings = {}
+    for name, step in (
+        ("question_bank", question_bank.stats),
+        ("profile_store", profile_store.stats),
+        ("explanation_cache", explanation_cache.load),
+    ):
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.warning("Warm-up of %s failed: %s", name, e)
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    started = time.perf_counter()
+    for model in (GeneratedTest, GradeResponse, GradeAnalysis, PersonalizedPlan):
+        gemini_response_schema(model)
+    timings["response_schemas"] = round((time.perf_counter() - started) * 1000, 1)
+    return timings
+
+
+async def warm_up() -> Dict[str, Any]:
+    """
+    Run the local priming (in a thread) concurrently with opening the Gemini connection
+    pool, so the first requests after a (re)start see warm caches and no TLS handshake.
+    Never raises: a failed step only leaves that part cold.
+    """
+    started = time.perf_counter()
+    local, connections = await asyncio.gather(asyncio.to_thread(_prime_local), gateway.warmup())
+    report = {
+        "connections": connections,
+        "local_ms": local,
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    logger.info("Worker warm-up done in %.1f ms (%d Gemini connections)", report["total_ms"], connections)
+    return report
@@ -0,0 +1,259 @@
+"""
+Offline stand-in for the Gemini REST API, for benchmarks and local runs without quota.
+
+Serves `POST /v1beta/models/{model}:generateContent` and `:streamGenerateContent?alt=sse`
+with the response shape gemini_gateway parses (the same endpoints and JSON the
+google-genai SDK uses; the key is accepted as `?key=` or `x-goog-api-key`).
+Output is templated from the request: a generated test when the response schema (or the
+prompt) asks for `data`, a grading analysis when it asks for `per_question`, and
+explanations for the wrong answers only when it asks for `explanations`.
+
+    python -m bench.fake_gemini --port 8090 --latency-ms 800 --error-rate 0.02
+    GEMINI_BASE_URL=http://127.0.0.1:8090/v1beta GEMINI_API_KEY=fake uvicorn app.main:app
+"""
+import os
+import re
+import json
+import math
+import uuid
+import random
+import asyncio
+import argparse
+from collections import Counter, defaultdict
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class FakeConfig:
+    """Latency is log-normal around `latency_ms` (median); errors are drawn per call."""
+
+    def __init__(self):
+        self.latency_ms = float(os.getenv("FAKE_GEMINI_LATENCY_MS", "800"))
+        self.latency_sigma = float(os.getenv("FAKE_GEMINI_LATENCY_SIGMA", "0.5"))
+        self.error_rate = float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0"))
+        self.rate_limit_rate = float(os.getenv("FAKE_GEMINI_RATE_LIMIT_RATE", "0"))
+        self.stream_chunks = int(os.getenv("FAKE_GEMINI_STREAM_CHUNKS", "8"))
+        # Share of generated questions drawn from a fixed pool, so the API re-stores known items
+        self.repeat_rate = float(os.getenv("FAKE_GEMINI_REPEAT_RATE", "0.1"))
+        self.random = random.Random(os.getenv("FAKE_GEMINI_SEED"))
+
+    def latency(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        return self.latency_ms / 1000 * math.exp(self.random.gauss(0, self.latency_sigma))
+
+    def failure(self) -> Optional[JSONResponse]:
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"code": 429, "message": "Resource has been exhausted (fake)", "status": "RESOURCE_EXHAUSTED"}},
+                headers={"Retry-After": "1"},
+            )
+        if roll < self.rate_limit_rate + self.error_rate:
+            return JSONResponse(
+                status_code=503,
+                content={"error": {"code": 503, "message": "The model is overloaded (fake)", "status": "UNAVAILABLE"}},
+            )
+        return None
+
+
+config = FakeConfig()
+app = FastAPI(title="Fake Gemini")
+stats: Counter = Counter()
+
+_COUNT = re.compile(r"(?:Generate|exactly) (\d+)\b")
+_ANSWERS = re.compile(r"^(?:Wrong )?Answers[^:]*:\s*(\[.*\])\s*$", re.MULTILINE)
+
+
+def _prompt(body: Dict[str, Any]) -> str:
+    return "".join(
+        part.get("text", "")
+        for content in body.get("contents") or []
+        for part in content.get("parts") or []
+    )
+
+
+def _schema_keys(body: Dict[str, Any]) -> set:
+    schema = (body.get("generationConfig") or {}).get("responseSchema") or {}
+    return set((schema.get("properties") or {}).keys())
+
+
+_RECURRING_QUESTIONS = 200
+
+
+def fake_test(prompt: str) -> Dict[str, Any]:
+    match = _COUNT.search(prompt)
+    count = int(match.group(1)) if match else 10
+    batch = uuid.uuid4().hex[:8]
+    questions = []
+    recurring = config.random.sample(range(_RECURRING_QUESTIONS), min(count, _RECURRING_QUESTIONS))
+    for i in range(count):
+        name, n = f"{batch}-{i}", i
+        if recurring and config.random.random() < config.repeat_rate:
+            n = recurring.pop()
+            name = f"recurring-{n}"
+        options = [f"option {name}-{k}" for k in "abcd"]
+        questions.append({
+            "type": "multiple_choice",
+            "skill": "Grammar",
+            "topic": ["Fake topic"],
+            "question": f"Fake question {name}: choose the correct form of the verb in sentence {n}.",
+            "options": options,
+            "answer": options[n % 4],
+            "explanation": f"Option {n % 4 + 1} is the grammatically correct form.",
+        })
+    return {"status": "success", "data": questions}
+
+
+def fake_grade(prompt: str, incremental: bool = False) -> Dict[str, Any]:
+    match = _ANSWERS.search(prompt)
+    rows = json.loads(match.group(1)) if match else []
+    per_question, by_skill, weak = [], defaultdict(lambda: [0, 0]), []
+    for row in rows:
+        given = row.get("given")
+        correct = bool(given) and str(given).strip().upper() == str(row.get("expected", "")).upper()
+        skill = row.get("skill") or "Grammar"
+        by_skill[skill][0] += int(correct)
+        by_skill[skill][1] += 1
+        if not correct and row.get("topic"):
+            weak.append(row["topic"])
+        per_question.append({
+            "id": row.get("id"), "question": row.get("q"), "correct": correct,
+            "expected_answer": row.get("expected", ""), "user_answer": given,
+            "skill": skill, "topic": row.get("topic"),
+            "explain": "Correct." if correct else f"The correct answer is {row.get('expected')}.",
+        })
+    score = sum(1 for p in per_question if p["correct"])
+    if incremental:
+        graded = {"explanations": [{"id": p["id"], "explain": p["explain"]} for p in per_question if not p["correct"]]}
+    else:
+        graded = {
+            "total_score": score,
+            "total_questions": len(per_question),
+            "per_question": per_question,
+            "skill_summary": [
+                {"skill": s, "total": n, "correct": c, "accuracy": round(c / n * 100, 1)}
+                for s, (c, n) in by_skill.items()
+            ],
+            "weak_topics": sorted(set(weak)),
+        }
+    return {
+        **graded,
+        "recommendations": ["Review the weak topics listed above."],
+        "personalized_plan": {
+            "progress_speed": {
+                "category": "steady",
+                "description": "Fake analysis.",
+                "recommendation": "Keep practicing.",
+            },
+            "weekly_goals": [
+                {"week": 1, "topic": "Grammar", "description": "Fake goal.", "study_methods": ["Practice"],
+                 "materials": [], "hours": 4},
+            ],
+        },
+        "current_level": "Intermediate",
+        "post_test_level": "Intermediate",
+    }
+
+
+def render(body: Dict[str, Any]) -> str:
+    prompt = _prompt(body)
+    keys = _schema_keys(body)
+    if "explanations" in keys:
+        return json.dumps(fake_grade(prompt, incremental=True), ensure_ascii=False)
+    if "per_question" in keys or (not keys and "REQUIRED OUTPUT SCHEMA" in prompt):
+        return json.dumps(fake_grade(prompt), ensure_ascii=False)
+    if "data" in keys or (not keys and "questions" in prompt):
+        return json.dumps(fake_test(prompt), ensure_ascii=False)
+    return "OK"
+
+
+def _usage(prompt: str, text: str) -> Dict[str, int]:
+    prompt_tokens, output_tokens = len(prompt) // 4, len(text) // 4
+    return {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens}
+
+
+def _response(model: str, text: str, usage: Optional[Dict[str, int]], finish: bool = True) -> Dict[str, Any]:
+    candidate: Dict[str, Any] = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+    if finish:
+        candidate["finishReason"] = "STOP"
+    data: Dict[str, Any] = {"candidates": [candidate], "modelVersion": model, "responseId": uuid.uuid4().hex}
+    if usage:
+        data["usageMetadata"] = usage
+    return data
+
+
+@app.post("/v1beta/models/{model_action}")
+async def models(model_action: str, request: Request):
+    model, _, action = model_action.partition(":")
+    if action not in ("generateContent", "streamGenerateContent"):
+        return JSONResponse(status_code=404, content={"error": {"code": 404, "message": f"Unknown method {action}"}})
+    if not (request.query_params.get("key") or request.headers.get("x-goog-api-key")):
+        return JSONResponse(status_code=403, content={"error": {"code": 403, "message": "API key missing"}})
+
+    stats[action] += 1
+    body = await request.json()
+    delay = config.latency()
+    failure = config.failure()
+    if failure is not None:
+        stats[f"status_{failure.status_code}"] += 1
+        await asyncio.sleep(delay / 4)
+        return failure
+
+    text = render(body)
+    usage = _usage(_prompt(body), text)
+    if action == "generateContent":
+        await asyncio.sleep(delay)
+        return _response(model, text, usage)
+
+    async def events():
+        # Time to first token ~ a third of the latency, the rest spread over the chunks
+        await asyncio.sleep(delay / 3)
+        chunks = max(1, config.stream_chunks)
+        size = math.ceil(len(text) / chunks)
+        for i in range(0, len(text), size):
+            yield f"data: {json.dumps(_response(model, text[i:i + size], None, finish=False))}\r\n\r\n"
+            await asyncio.sleep(delay * 2 / 3 / chunks)
+        yield f"data: {json.dumps(_response(model, '', usage))}\r\n\r\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def fake_stats():
+    return dict(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline fake Gemini API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=config.latency_ms, help="median latency")
+    parser.add_argument("--latency-sigma", type=float, default=config.latency_sigma, help="log-normal sigma")
+    parser.add_argument("--error-rate", type=float, default=config.error_rate, help="fraction of 503s")
+    parser.add_argument("--rate-limit-rate", type=float, default=config.rate_limit_rate, help="fraction of 429s")
+    parser.add_argument("--stream-chunks", type=int, default=config.stream_chunks)
+    parser.add_argument("--repeat-rate", type=float, default=config.repeat_rate,
+                        help="fraction of questions repeated from a fixed pool")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config.latency_ms = args.latency_ms
+    config.latency_sigma = args.latency_sigma
+    config.error_rate = args.error_rate
+    config.rate_limit_rate = args.rate_limit_rate
+    config.stream_chunks = args.stream_chunks
+    config.repeat_rate = args.repeat_rate
+    if args.seed is not None:
+        config.random.seed(args.seed)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+End-to-end load benchmark against the fake Gemini server, no network or quota needed.
+
+Starts bench.fake_gemini and the API (uvicorn app.main:app) as subprocesses with
+throwaway data files, then drives each scenario at a fixed concurrency and reports
+p50/p95/p99 latency, throughput, error counts and the API's event-loop lag.
+
+    python -m bench.load_test --concurrency 16 --requests 200 --latency-ms 800
+    python -m bench.load_test --scenarios grade --json bench-results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+
+def _free_port() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def topic_payload(i: int) -> Dict[str, Any]:
+    return {"topic": "Business travel", "num_questions": 10, "exam_type": "TOEIC",
+            "score_range": "550-780", "fresh": True}
+
+
+def custom_payload(i: int) -> Dict[str, Any]:
+    return {"current_level": "Intermediate", "toeic_score": 600, "weak_skills": ["Grammar", "Vocabulary"],
+            "topics": ["Present perfect", "Prepositions of time", "Office vocabulary"],
+            "num_questions": 15, "fresh": True}
+
+
+def grade_payload(i: int, questions: int = 20, past_tests: int = 8) -> Dict[str, Any]:
+    rng = random.Random(i)
+    skills = ["Grammar", "Vocabulary", "Reading", "Listening"]
+    answer_key = [
+        {"id": q, "question": f"Question {q} about topic {q % 5}", "answer": "ABCD"[q % 4],
+         "skill": skills[q % 4], "topic": f"Topic {q % 5}"}
+        for q in range(1, questions + 1)
+    ]
+    history = [
+        {"test_date": f"2025-0{1 + t % 9}-1{t % 10}", "level_at_test": "Intermediate",
+         "weak_topics": [f"Topic {t % 5}"],
+         "per_question": [
+             {"id": q["id"], "correct": rng.random() < 0.6, "expected_answer": q["answer"],
+              "skill": q["skill"], "topic": q["topic"]}
+             for q in answer_key
+         ]}
+        for t in range(past_tests)
+    ]
+    return {
+        "test_info": {"title": "Benchmark test", "total_questions": questions},
+        "answer_key": answer_key,
+        "student_answers": {str(q["id"]): rng.choice("ABCD") for q in answer_key},
+        "use_gemini": True,
+        "profile": {
+            "student_id": f"bench-{i % 50}", "name": "Bench Student", "current_level": "Intermediate",
+            "study_hours_per_week": 6, "learning_goals": "TOEIC 750", "learning_preferences": ["visual"],
+            "study_methods": ["practice tests"], "test_history": history,
+        },
+    }
+
+
+SCENARIOS: Dict[str, tuple] = {
+    "generate-test": ("/generate-test/", topic_payload),
+    "generate-test-custom": ("/generate-test-custom/", custom_payload),
+    "grade": ("/grade/", grade_payload),
+}
+
+
+async def _sample_lag(client: httpx.AsyncClient, samples: List[float], stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            resp = await client.get("/health", timeout=5)
+            samples.append(resp.json()["gemini_gateway"]["event_loop"]["last_lag_seconds"])
+        except (httpx.HTTPError, KeyError, ValueError):
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), 0.5)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_scenario(base_url: str, name: str, path: str, payload: Callable[[int], Dict[str, Any]],
+                       concurrency: int, requests: int, timeout: float) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    lag: List[float] = []
+    degraded = [0]
+    counter = iter(range(requests))
+
+    limits = httpx.Limits(max_connections=concurrency + 2, max_keepalive_connections=concurrency + 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def worker():
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    resp = await client.post(path, json=payload(i))
+                    statuses[resp.status_code] += 1
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                    continue
+                if resp.status_code == 200:
+                    latencies.append(time.perf_counter() - started)
+                    # /grade answered with the local result only (Gemini late or failing)
+                    if resp.json().get("enrichment_skipped"):
+                        degraded[0] += 1
+
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(_sample_lag(client, lag, stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampler
+
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(latencies),
+        "degraded": degraded[0],
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "loop_lag_max_ms": round(max(lag, default=0.0) * 1000, 1),
+        "loop_lag_p95_ms": round(percentile(lag, 95) * 1000, 1),
+    }
+
+
+async def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {proc.returncode}")
+            try:
+                await client.get(url, timeout=1)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+
+def _spawn(args: List[str], env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "wb")
+    return subprocess.Popen([sys.executable, *args], env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def main_async(args) -> List[Dict[str, Any]]:
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    fake_port, api_port = _free_port(), _free_port()
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_BASE_URL": f"http://127.0.0.1:{fake_port}/v1beta",
+        "GEMINI_API_KEY": "fake-key",
+        "GEMINI_API_KEYS": ",".join(f"fake-key-{k}" for k in range(args.keys)),
+        "QUESTION_BANK_PATH": os.path.join(workdir, "question_bank.db"),
+        "GRADING_JOBS_PATH": os.path.join(workdir, "grading_jobs.db"),
+        "LEARNING_PROFILE_PATH": os.path.join(workdir, "learning_profiles.db"),
+        "EXPLANATION_CACHE_PATH": os.path.join(workdir, "explanation_cache.db"),
+        "CAT_SESSIONS_PATH": os.path.join(workdir, "adaptive_sessions.db"),
+    })
+
+    fake = _spawn(["-m", "bench.fake_gemini", "--port", str(fake_port),
+                   "--latency-ms", str(args.latency_ms), "--latency-sigma", str(args.latency_sigma),
+                   "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate),
+                   "--seed", "1"],
+                  env, os.path.join(workdir, "fake_gemini.log"))
+    api = _spawn(["-m", "uvicorn", "app.main:app", "--port", str(api_port), "--log-level", "warning"],
+                 env, os.path.join(workdir, "api.log"))
+    results = []
+    try:
+        await _wait_ready(f"http://127.0.0.1:{fake_port}/stats", fake)
+        await _wait_ready(f"http://127.0.0.1:{api_port}/health", api)
+        base_url = f"http://127.0.0.1:{api_port}"
+        for name in args.scenarios:
+            path, payload = SCENARIOS[name]
+            if args.warmup:
+                await run_scenario(base_url, name, path, payload, min(args.concurrency, args.warmup),
+                                   args.warmup, args.timeout)
+            results.append(await run_scenario(base_url, name, path, payload, args.concurrency,
+                                              args.requests, args.timeout))
+        # the fake repeats some questions, so generated tests also re-store banked items
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            print(f"question bank: {(await client.get('/question-bank/stats')).json()}", file=sys.stderr)
+    finally:
+        for proc in (api, fake):
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    with open(os.path.join(workdir, "api.log"), errors="replace") as f:
+        store_failures = sum("Could not store generated questions" in line for line in f)
+    if store_failures:
+        print(f"WARNING: {store_failures} generated tests could not be stored in the question bank", file=sys.stderr)
+    print(f"logs: {workdir}", file=sys.stderr)
+    return results
+
+
+def _print_table(results: List[Dict[str, Any]]):
+    columns = ["scenario", "ok", "degraded", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "loop_lag_max_ms", "statuses"]
+    rows = [[str(r[c]) for c in columns] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load benchmark against a fake Gemini backend")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests before each scenario")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--keys", type=int, default=1, help="number of fake API keys to route over")
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(main_async(args))
+    _print_table(results)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Worker startup benchmark: how long a fresh API process takes to import, to report ready,
+and to serve its first Gemini-backed request, with and without the lifespan warm-up.
+
+Each run spawns uvicorn app.main:app against bench.fake_gemini (throwaway data files)
+and measures from process spawn:
+- import_ms: `import app.main` alone, in a separate interpreter
+- ready_ms: until GET /health answers (the lifespan, warm-up included, has finished)
+- first_request_ms: latency of the first POST /grade/ right after that
+
+    python -m bench.startup --runs 5
+    python -m bench.startup --configs warm --json startup.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from bench.load_test import _free_port, _spawn, _wait_ready, grade_payload
+
+# /health polling step; load_test._wait_ready polls every 200 ms, too coarse to time a boot
+POLL_SECONDS = 0.01
+
+CONFIGS = {
+    "cold": {"STARTUP_WARMUP": "0"},
+    "warm": {"STARTUP_WARMUP": "1"},
+}
+
+
+def measure_import() -> float:
+    code = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1]) * 1000
+
+
+async def measure_boot(env: Dict[str, str], workdir: str, run: int) -> Dict[str, Any]:
+    port = _free_port()
+    started = time.perf_counter()
+    api = _spawn(["-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+                 env, os.path.join(workdir, f"api-{run}.log"))
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            while True:
+                if api.poll() is not None:
+                    raise RuntimeError(f"API exited with code {api.returncode}")
+                try:
+                    await client.get("/health", timeout=1)
+                    break
+                except httpx.TransportError:
+                    if time.perf_counter() - started > 60:
+                        raise RuntimeError("API did not start within 60s")
+                    await asyncio.sleep(POLL_SECONDS)
+            ready_ms = (time.perf_counter() - started) * 1000
+            sent = time.perf_counter()
+            resp = await client.post("/grade/", json=grade_payload(run))
+            first_ms = (time.perf_counter() - sent) * 1000
+            warmup = (await client.get("/health")).json().get("warmup")
+    finally:
+        api.terminate()
+        try:
+            api.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            api.kill()
+    return {"ready_ms": ready_ms, "first_request_ms": first_ms, "status": resp.status_code, "warmup": warmup}
+
+
+async def main_async(args) -> List[Dict[str, Any]]:
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    fake_port = _free_port()
+    base_env = dict(os.environ)
+    base_env.update({
+        "GEMINI_BASE_URL": f"http://127.0.0.1:{fake_port}/v1beta",
+        "GEMINI_API_KEY": "fake-key",
+        "GEMINI_API_KEYS": "fake-key",
+    })
+    fake = _spawn(["-m", "bench.fake_gemini", "--port", str(fake_port), "--latency-ms", str(args.latency_ms),
+                   "--latency-sigma", "0", "--seed", "1"],
+                  base_env, os.path.join(workdir, "fake_gemini.log"))
+    results = []
+    try:
+        await _wait_ready(f"http://127.0.0.1:{fake_port}/stats", fake)
+        imports = [measure_import() for _ in range(args.runs)]
+        for name in args.configs:
+            runs = []
+            for run in range(args.runs):
+                env = dict(base_env, **CONFIGS[name])
+                # fresh data files per run, so no boot reuses stores another run already opened
+                for var, file in (("QUESTION_BANK_PATH", "question_bank.db"), ("GRADING_JOBS_PATH", "grading_jobs.db"),
+                                  ("LEARNING_PROFILE_PATH", "profiles.db"),
+                                  ("EXPLANATION_CACHE_PATH", "explanations.db"),
+                                  ("CAT_SESSIONS_PATH", "adaptive_sessions.db")):
+                    env[var] = os.path.join(workdir, f"{name}-{run}-{file}")
+                runs.append(await measure_boot(env, workdir, run))
+            results.append({
+                "config": name,
+                "runs": len(runs),
+                "import_ms": round(statistics.median(imports), 1),
+                "ready_ms": round(statistics.median(r["ready_ms"] for r in runs), 1),
+                "first_request_ms": round(statistics.median(r["first_request_ms"] for r in runs), 1),
+                "statuses": sorted({r["status"] for r in runs}),
+                "warmup": runs[-1]["warmup"],
+            })
+    finally:
+        fake.terminate()
+        try:
+            fake.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            fake.kill()
+    print(f"logs: {workdir}", file=sys.stderr)
+    return results
+
+
+def _print_table(results: List[Dict[str, Any]]):
+    columns = ["config", "runs", "import_ms", "ready_ms", "first_request_ms", "statuses"]
+    rows = [[str(r[c]) for c in columns] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Worker startup benchmark against a fake Gemini backend")
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGS), default=list(CONFIGS))
+    parser.add_argument("--runs", type=int, default=3, help="process starts per config")
+    parser.add_argument("--latency-ms", type=float, default=50, help="fake Gemini latency")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(main_async(args))
+    _print_table(results)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()